@@ -2,6 +2,8 @@
 """Git clean filter for SQLite databases."""
 
 import argparse
+import contextlib
+import io
 import os
 import shutil
 import signal
@@ -12,9 +14,14 @@ import tempfile
 import time
 
 from .utils import (
+    COPY_BUFSIZE,
+    FTS_SHADOW_SUFFIXES,
     collation_func,
+    copy_stream,
     extract_missing_collation,
+    fts_shadow_tables,
     get_common_args,
+    register_missing_collation,
     should_skip_submodule,
 )
 
@@ -30,23 +37,58 @@ def log(msg):
     sys.stderr.write(f"{TOOL} {msg}\n")
 
 
-def format_sql_value(val, float_precision=None):
-    """Format a Python value into its SQLite literal representation."""
-    if val is None:
-        return "NULL"
-    if isinstance(val, (int, float)):
-        if float_precision is not None and isinstance(val, float):
-            # Normalize floats to prevent ghost diffs
-            v_str = format(val, f".{float_precision}f").rstrip("0").rstrip(".")
-            return v_str or "0.0"
+def _format_null(_val, _float_precision):
+    return "NULL"
+
+
+def _format_int(val, _float_precision):
+    return str(val)
+
+
+def _format_float(val, float_precision):
+    if float_precision is None:
         return str(val)
-    if isinstance(val, bytes):
-        return f"X'{val.hex().upper()}'"
+    # Normalize floats to prevent ghost diffs
+    v_str = format(val, f".{float_precision}f").rstrip("0").rstrip(".")
+    return v_str or "0.0"
+
+
+def _format_blob(val, _float_precision):
+    return f"X'{val.hex().upper()}'"
+
+
+def _format_text(val, _float_precision):
     # String escaping
     escaped = str(val).replace("'", "''")
     return f"'{escaped}'"
 
 
+# Exact-type dispatch for the types sqlite3 hands back; one dict lookup per value
+_VALUE_FORMATTERS = {
+    type(None): _format_null,
+    int: _format_int,
+    float: _format_float,
+    bytes: _format_blob,
+    str: _format_text,
+}
+
+
+def format_sql_value(val, float_precision=None):
+    """Format a Python value into its SQLite literal representation."""
+    formatter = _VALUE_FORMATTERS.get(type(val))
+    if formatter is None:
+        # Subclasses (e.g. bool) and other types fall back to isinstance checks
+        if isinstance(val, float):
+            formatter = _format_float
+        elif isinstance(val, int):
+            formatter = _format_int
+        elif isinstance(val, bytes):
+            formatter = _format_blob
+        else:
+            formatter = _format_text
+    return formatter(val, float_precision)
+
+
 def get_table_metadata(conn, table_name, debug=False):
     """Identify insertable columns and primary keys for stable sorting."""
     try:
@@ -85,6 +127,7 @@ class DatabaseDumper:
         self.args = args
         self.debug = debug
         self.registered_collations = set()
+        self.out = None
         self.conn = self._connect()
 
     def __enter__(self):
@@ -103,16 +146,32 @@ class DatabaseDumper:
 
     def _ensure_collation(self, error_msg):
         """Register missing collation and reconnect if needed."""
-        col_name = extract_missing_collation(error_msg)
-        if col_name and col_name not in self.registered_collations:
-            if self.debug:
-                log(f"registering missing collation: {col_name}")
-            self.registered_collations.add(col_name)
+        tool_name = TOOL if self.debug else None
+        if register_missing_collation(error_msg, self.registered_collations, tool_name):
             self.conn.close()
             self.conn = self._connect()
             return True
         return False
 
+    @staticmethod
+    def _custom_collated_columns(probe, table_name, columns):
+        """
+        Map the columns declared with a non built-in collation to its name.
+        collation_func compares code points, which matches BINARY only for
+        UTF-8 text, so callers pass a probe only for UTF-8 databases.
+        """
+        # A connection without our collations fails to prepare on exactly
+        # the columns that need one
+        custom = {}
+        for col in columns:
+            try:
+                probe.execute(f'EXPLAIN SELECT 1 FROM "{table_name}" ORDER BY "{col}"')
+            except sqlite3.OperationalError as e:
+                collation = extract_missing_collation(e)
+                if collation:
+                    custom[col] = collation
+        return custom
+
     def _find_shadow_tables(self):
         """Identify actual FTS shadow tables by scanning virtual table definitions."""
         shadow_tables = set()
@@ -131,21 +190,14 @@ class DatabaseDumper:
 
     def _analyze_virtual_table(self, name, sql_upper, shadow_tables):
         """Analyze a virtual table definition to find its shadow tables."""
-        if "USING FTS5" in sql_upper:
-            # FTS5 creates: _data, _idx, _content, _docsize, _config
-            suffixes = ["_data", "_idx", "_content", "_docsize", "_config"]
-        elif "USING FTS3" in sql_upper or "USING FTS4" in sql_upper:
-            # FTS3/4 creates: _content, _segments, _segdir, _docsize, _stat
-            suffixes = ["_content", "_segments", "_segdir", "_docsize", "_stat"]
-        else:
-            return
-
-        for suffix in suffixes:
-            shadow_name = f"{name}{suffix}"
-            shadow_tables.add(shadow_name)
-
-    def dump(self):
-        """Perform the full semantic dump."""
+        for module in FTS_SHADOW_SUFFIXES:
+            if f"USING {module}" in sql_upper:
+                shadow_tables.update(fts_shadow_tables(name, module))
+                return
+
+    def dump(self, out=None):
+        """Perform the full semantic dump to out (default: sys.stdout)."""
+        self.out = sys.stdout if out is None else out
         try:
             shadow_tables = self._find_shadow_tables()
             self._dump_header()
@@ -164,9 +216,9 @@ class DatabaseDumper:
             user_version = self.conn.execute("PRAGMA user_version").fetchone()[0]
             if self.debug:
                 log(f"user_version: {user_version}")
-            sys.stdout.write(f"PRAGMA user_version = {user_version};\n")
-            sys.stdout.write("PRAGMA foreign_keys=OFF;\n")
-            sys.stdout.write("BEGIN TRANSACTION;\n")
+            self.out.write(f"PRAGMA user_version = {user_version};\n")
+            self.out.write("PRAGMA foreign_keys=OFF;\n")
+            self.out.write("BEGIN TRANSACTION;\n")
 
     def _dump_schema(self, shadow_tables):
         if self.args.data_only:
@@ -192,7 +244,7 @@ class DatabaseDumper:
                 sql = obj["sql"].strip()
                 if not sql.endswith(";"):
                     sql += ";"
-                sys.stdout.write(f"{sql}\n")
+                self.out.write(f"{sql}\n")
 
     def _dump_data(self, shadow_tables):
         if self.args.schema_only:
@@ -205,17 +257,24 @@ class DatabaseDumper:
             ORDER BY name ASC
         """).fetchall()
 
-        for obj in objects:
-            if obj["name"] in shadow_tables:
-                continue
-            self._dump_table_data(obj["name"])
+        # One probe per dump; BINARY stands in for collation_func only in UTF-8
+        encoding = self.conn.execute("PRAGMA encoding").fetchone()[0]
+        probe = sqlite3.connect(self.db_path) if encoding == "UTF-8" else None
+        try:
+            for obj in objects:
+                if obj["name"] in shadow_tables:
+                    continue
+                self._dump_table_data(obj["name"], probe)
+        finally:
+            if probe:
+                probe.close()
 
     def _dump_footer(self, _shadow_tables):
         if not self.args.data_only:
             self._dump_extras()
-            sys.stdout.write("COMMIT;\n")
+            self.out.write("COMMIT;\n")
 
-    def _dump_table_data(self, table_name):
+    def _dump_table_data(self, table_name, probe=None):
         """Stream sorted rows for a given table."""
         # Skip Virtual Tables
         sql = self.conn.execute(
@@ -232,20 +291,35 @@ class DatabaseDumper:
                 log(f"skipping data for {table_name} (no insertable columns)")
             return
 
-        # Improved Determinism: Sort by PKs or fall back to all columns
-        if pks:
-            pk_list = ", ".join(f'"{pk}"' for pk in pks)
-            order_by = f"ORDER BY {pk_list}"
-        else:
-            all_cols = ", ".join(f'"{c}"' for c in cols)
-            order_by = f"ORDER BY {all_cols}"
-
         col_list = ", ".join(f'"{c}"' for c in cols)
 
-        if self.debug:
-            log(f"dumping table: {table_name}, columns: [{col_list}], sort: {order_by}")
+        custom = {}
+        if probe and not pks and sql and "COLLATE" in sql["sql"].upper():
+            custom = self._custom_collated_columns(probe, table_name, cols)
 
         while True:
+            # Improved Determinism: Sort by PKs or fall back to all columns
+            if pks:
+                pk_list = ", ".join(f'"{pk}"' for pk in pks)
+                order_by = f"ORDER BY {pk_list}"
+            else:
+                # Full sort: compare custom-collated columns as BINARY in C
+                all_cols = ", ".join(
+                    (
+                        f'"{c}" COLLATE BINARY'
+                        if custom.get(c) in self.registered_collations
+                        else f'"{c}"'
+                    )
+                    for c in cols
+                )
+                order_by = f"ORDER BY {all_cols}"
+
+            if self.debug:
+                log(
+                    f"dumping table: {table_name}, columns: [{col_list}], "
+                    f"sort: {order_by}"
+                )
+
             try:
                 # Use rowid if no PKs/insertable cols match logic
                 cursor = self.conn.execute(
@@ -253,7 +327,7 @@ class DatabaseDumper:
                 )
                 for row in cursor:
                     vals = [format_sql_value(v, self.args.float_precision) for v in row]
-                    sys.stdout.write(
+                    self.out.write(
                         f'INSERT INTO "{table_name}" ({col_list}) '
                         f"VALUES ({', '.join(vals)});\n"
                     )
@@ -275,19 +349,19 @@ class DatabaseDumper:
             sql = extra[0].strip()
             if not sql.endswith(";"):
                 sql += ";"
-            sys.stdout.write(f"{sql}\n")
+            self.out.write(f"{sql}\n")
 
         # Autoincrement (sqlite_sequence)
         has_seq = self.conn.execute(
             "SELECT 1 FROM sqlite_master WHERE name='sqlite_sequence'"
         ).fetchone()
         if has_seq:
-            sys.stdout.write('DELETE FROM "sqlite_sequence";\n')
+            self.out.write('DELETE FROM "sqlite_sequence";\n')
             seq_rows = self.conn.execute(
                 'SELECT name, seq FROM "sqlite_sequence" ORDER BY name ASC'
             ).fetchall()
             for row in seq_rows:
-                sys.stdout.write(
+                self.out.write(
                     f'INSERT INTO "sqlite_sequence" (name, seq) '
                     f"VALUES ('{row[0]}', {row[1]});\n"
                 )
@@ -297,9 +371,12 @@ def maybe_warn():
     """Print a safety warning if not printed recently (5s debounce)."""
     sentinel = os.path.join(tempfile.gettempdir(), "git_sqlite_warn_lock")
     try:
-        # Check if warning was shown recently
-        if os.path.exists(sentinel) and (time.time() - os.path.getmtime(sentinel) < 5):
-            return
+        # Check if warning was shown recently (one stat, no separate exists check)
+        try:
+            if time.time() - os.stat(sentinel).st_mtime < 5:
+                return
+        except FileNotFoundError:
+            pass
 
         log(
             "WARNING: YOU CAN EASILY LOSE DATA IF YOU ISSUE WRITE COMMANDS!!! "
@@ -330,16 +407,18 @@ def debug_versions(db_file):
         log(f"sqlite3 binary version: error getting version ({e})")
 
 
-def check_fast_path(db_file, debug=False):
-    """Check if we can use the fast pass-through path (not an sqlite file)."""
+def check_fast_path(db_file, debug=False, out=None):
+    """Check if we can use the fast pass-through path (not an sqlite file).
+    Passed-through bytes go to out (a binary stream; default: stdout)."""
     try:
         with open(db_file, "rb") as f:
             header = f.read(16)
             if header != b"SQLite format 3\x00":
                 if debug:
                     log(f"magic header mismatch: {header!r}; falling back to binary")
-                sys.stdout.buffer.write(header)
-                shutil.copyfileobj(f, sys.stdout.buffer)
+                out = sys.stdout.buffer if out is None else out
+                out.write(header)
+                shutil.copyfileobj(f, out, COPY_BUFSIZE)
                 return True
     except OSError:
         pass
@@ -371,8 +450,9 @@ def run_backup(db_file, tmp_path, debug=False):
         return subprocess.CompletedProcess(backup_cmd, 1, stderr=b"timeout")
 
 
-def fallback_dump(db_file, debug=False):
-    """Fallback strategies if main dump fails."""
+def fallback_dump(db_file, debug=False, out=None):
+    """Fallback strategies if main dump fails (binary out; default: stdout)."""
+    out = sys.stdout.buffer if out is None else out
     # 1. Check if it's already a SQL dump (e.g. double smudging)
     try:
         with open(db_file, "rb") as f:
@@ -381,7 +461,7 @@ def fallback_dump(db_file, debug=False):
             if debug:
                 log(f"file {db_file} is not a SQLite database; passing through")
             with open(db_file, "rb") as f:
-                shutil.copyfileobj(f, sys.stdout.buffer)
+                copy_stream(f, out)
             return
     # pylint: disable=broad-exception-caught
     except Exception as e:
@@ -402,13 +482,53 @@ def fallback_dump(db_file, debug=False):
         res_git = subprocess.CompletedProcess([], 1)
 
     if res_git.returncode == 0:
-        sys.stdout.buffer.write(res_git.stdout)
+        out.write(res_git.stdout)
         return
 
     # 3. Ultimate fallback: Binary read
     log(f"error: {db_file} is inaccessible; using binary raw read")
     with open(db_file, "rb") as f:
-        shutil.copyfileobj(f, sys.stdout.buffer)
+        copy_stream(f, out)
+
+
+def _dump_to(dumper, out):
+    """Run dumper over a binary stream, or sys.stdout when out is None."""
+    if out is None:
+        return dumper.dump()
+    text = io.TextIOWrapper(out, encoding="utf-8", write_through=True)
+    try:
+        return dumper.dump(text)
+    finally:
+        text.detach()  # Leave out open for the caller
+
+
+def dump_database(db_file, args, debug=False, out=None):
+    """Write a semantic SQL dump of an SQLite database file to out
+    (a binary stream; default: stdout)."""
+    maybe_warn()
+
+    # Use a temporary backup for consistency and lock avoidance
+    with tempfile.NamedTemporaryFile(
+        prefix="sqlite_bak_", suffix=".sqlite", delete=False
+    ) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        res = run_backup(db_file, tmp_path, debug)
+
+        if res.returncode == 0:
+            with DatabaseDumper(tmp_path, args, debug=debug) as dumper:
+                if _dump_to(dumper, out):
+                    return
+        else:
+            err = res.stderr.decode().strip()
+            if "database is locked" not in err:
+                log(f"backup failed: {err}")
+            fallback_dump(db_file, debug, out)
+
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
 
 
 def main():
@@ -436,36 +556,13 @@ def main():
         # Fast binary pass-through using streaming I/O
         try:
             with open(args.db_file, "rb") as f:
-                shutil.copyfileobj(f, sys.stdout.buffer)
+                copy_stream(f, sys.stdout.buffer)
         except OSError as e:
             log(f"error reading file in fast-path: {e}")
             sys.exit(1)
         return
 
-    maybe_warn()
-
-    # Use a temporary backup for consistency and lock avoidance
-    with tempfile.NamedTemporaryFile(
-        prefix="sqlite_bak_", suffix=".sqlite", delete=False
-    ) as tmp:
-        tmp_path = tmp.name
-
-    try:
-        res = run_backup(args.db_file, tmp_path, debug)
-
-        if res.returncode == 0:
-            with DatabaseDumper(tmp_path, args, debug=debug) as dumper:
-                if dumper.dump():
-                    return
-        else:
-            err = res.stderr.decode().strip()
-            if "database is locked" not in err:
-                log(f"backup failed: {err}")
-            fallback_dump(args.db_file, debug)
-
-    finally:
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
+    dump_database(args.db_file, args, debug)
 
 
 if __name__ == "__main__":
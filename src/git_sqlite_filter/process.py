@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Git long-running filter process (filter.<driver>.process) for SQLite databases.
+
+Speaks Git's pkt-line protocol so a single Python process serves every
+clean/smudge request of a checkout, instead of paying interpreter startup
+and imports once per file.
+"""
+
+import argparse
+import io
+import os
+import signal
+import sys
+import tempfile
+
+from .clean import check_fast_path, dump_database
+from .smudge import restore_database
+from .utils import copy_stream, get_common_args, should_skip_submodule
+
+# Handle broken pipes (e.g. | head) without stack trace (Unix only)
+if hasattr(signal, "SIGPIPE"):
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+TOOL = "[git-sqlite-filter]"
+
+# pkt-line: 4 hex digits of length (including themselves) + payload
+MAX_PACKET_DATA = 65516
+FLUSH = b"0000"
+CAPABILITIES = ("clean", "smudge")
+
+
+def log(msg):
+    """Write a message to stderr with the tool prefix."""
+    sys.stderr.write(f"{TOOL} {msg}\n")
+
+
+class ProtocolError(Exception):
+    """Raised when Git sends something the protocol does not allow."""
+
+
+def read_packet(stream):
+    """Read one pkt-line; returns None for a flush packet, raises EOFError on EOF."""
+    header = stream.read(4)
+    if not header:
+        raise EOFError
+    if len(header) != 4:
+        raise ProtocolError(f"truncated packet header: {header!r}")
+    length = int(header, 16)
+    if length == 0:
+        return None
+    if length <= 4:
+        raise ProtocolError(f"invalid packet length: {length}")
+    data = stream.read(length - 4)
+    if len(data) != length - 4:
+        raise ProtocolError("truncated packet")
+    return data
+
+
+def read_text_list(stream):
+    """Read text packets up to the next flush, without trailing newlines."""
+    lines = []
+    while True:
+        packet = read_packet(stream)
+        if packet is None:
+            return lines
+        lines.append(packet.decode("utf-8").rstrip("\n"))
+
+
+def read_content(stream, dst):
+    """Copy content packets up to the next flush into a binary file object."""
+    while True:
+        packet = read_packet(stream)
+        if packet is None:
+            return
+        dst.write(packet)
+
+
+def write_packet(stream, data):
+    """Write a single pkt-line."""
+    stream.write(b"%04x" % (len(data) + 4))
+    stream.write(data)
+
+
+def write_text_list(stream, lines):
+    """Write text packets followed by a flush."""
+    for line in lines:
+        write_packet(stream, f"{line}\n".encode())
+    stream.write(FLUSH)
+
+
+def write_content(stream, src):
+    """Write a binary file object as content packets followed by a flush."""
+    for chunk in iter(lambda: src.read(MAX_PACKET_DATA), b""):
+        write_packet(stream, chunk)
+    stream.write(FLUSH)
+
+
+def _key_values(lines):
+    """Parse key=value packets into a dict."""
+    return dict(line.split("=", 1) for line in lines if "=" in line)
+
+
+class FilterProcess:
+    """Serves clean/smudge requests from Git over stdin/stdout."""
+
+    def __init__(self, args, debug=False):
+        self.args = args
+        self.debug = debug
+        self.inp = sys.stdin.buffer
+        self.out = sys.stdout.buffer
+        # Config lookups fork git; do them once per checkout, not once per file
+        self.skip = should_skip_submodule(TOOL)
+
+    def handshake(self):
+        """Negotiate protocol version and capabilities with Git."""
+        welcome = read_text_list(self.inp)
+        if welcome[:1] != ["git-filter-client"] or "version=2" not in welcome:
+            raise ProtocolError(f"unexpected handshake: {welcome}")
+        write_text_list(self.out, ["git-filter-server", "version=2"])
+
+        offered = {
+            line.split("=", 1)[1]
+            for line in read_text_list(self.inp)
+            if line.startswith("capability=")
+        }
+        write_text_list(
+            self.out, [f"capability={c}" for c in CAPABILITIES if c in offered]
+        )
+        self.out.flush()
+
+    def serve(self):
+        """Handle requests until Git closes the pipe."""
+        self.handshake()
+        while True:
+            try:
+                request = _key_values(read_text_list(self.inp))
+            except EOFError:
+                return
+            with tempfile.TemporaryFile() as content, tempfile.TemporaryFile() as result:
+                read_content(self.inp, content)
+                content.seek(0)
+                ok = self._run(request, content, result)
+
+                if ok:
+                    result.seek(0)
+                    write_text_list(self.out, ["status=success"])
+                    write_content(self.out, result)
+                    write_text_list(self.out, [])  # Keep status=success
+                else:
+                    write_text_list(self.out, ["status=error"])
+            self.out.flush()
+
+    def _run(self, request, content, result):
+        """Execute one command, writing its output into result."""
+        command = request.get("command")
+        pathname = request.get("pathname", "")
+        if self.debug:
+            log(f"{command} {pathname}")
+
+        if self.skip:
+            copy_stream(content, result)
+            return True
+
+        try:
+            if command == "clean":
+                if not check_fast_path(pathname, self.debug, out=result):
+                    dump_database(pathname, self.args, self.debug, out=result)
+                return True
+            if command == "smudge":
+                stream = io.TextIOWrapper(content, encoding="utf-8")
+                return restore_database(stream, debug=self.debug, out=result)
+            log(f"error: unsupported command: {command}")
+            return False
+        except (Exception, SystemExit) as e:  # pylint: disable=broad-exception-caught
+            log(f"error: {command} failed for {pathname}: {e}")
+            return False
+
+
+def main():
+    """Entry point for git-sqlite-filter."""
+    parser = argparse.ArgumentParser(description="Git filter process for SQLite")
+    parser.add_argument(
+        "--process",
+        action="store_true",
+        help="Run as a long-running filter.<driver>.process (required)",
+    )
+    parser.add_argument("--float-precision", type=int, help="Round floats to X digits")
+
+    args = get_common_args(parser)
+    if not args.process:
+        parser.error("only --process mode is supported")
+    args.data_only = args.schema_only = False
+    debug = args.debug or os.environ.get("GIT_TRACE") in ("1", "true", "2")
+
+    try:
+        FilterProcess(args, debug=debug).serve()
+    except ProtocolError as e:
+        log(f"error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
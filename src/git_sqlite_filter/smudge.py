@@ -2,17 +2,29 @@
 """Git smudge filter for SQLite databases."""
 
 import argparse
+import contextlib
+import hashlib
 import os
 import re
 import shutil
 import signal
 import sqlite3
+import subprocess
 import sys
 import tempfile
+import threading
+from collections import namedtuple
 
 from .utils import (
+    CACHE_MAX_BYTES,
     collation_func,
+    copy_stream,
+    fts_shadow_tables,
+    get_cache_dir,
     get_common_args,
+    get_scratch_dir,
+    prune_cache,
+    register_missing_collation,
     should_skip_submodule,
 )
 
@@ -22,29 +34,43 @@ if hasattr(signal, "SIGPIPE"):
 
 TOOL = "[git-sqlite-smudge]"
 
+# Collations compiled into every sqlite3 binary (the CLI cannot call back into Python)
+BUILTIN_COLLATIONS = frozenset(("BINARY", "NOCASE", "RTRIM"))
+_CREATE_RE = re.compile(r"\s*CREATE\b", re.IGNORECASE)
+_COLLATE_RE = re.compile(r"\bCOLLATE\s+[\"'`\[]?(\w+)", re.IGNORECASE)
+_FTS_VTAB_RE = re.compile(
+    r"\s*CREATE\s+VIRTUAL\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"[\"'`\[]?(\w+)[\"'`\]]?\s+USING\s+(FTS[345])\b",
+    re.IGNORECASE,
+)
+# The sqlite3 shell runs a line starting with '.' as a dot-command (.shell, ...)
+_DOT_COMMAND_RE = re.compile(r"^\s*\.", re.MULTILINE)
+# Durability tuning for callers that throw the rebuilt database away (tests)
+FAST_PRAGMAS = (
+    "PRAGMA journal_mode=MEMORY; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY;"
+)
+_TRIGGER_ON_RE = re.compile(
+    r"\s*CREATE\s+(?:TEMP(?:ORARY)?\s+)?TRIGGER\b.*?\bON\s+"
+    r"(?:[\"'`\[]?\w+[\"'`\]]?\s*\.\s*)?"  # Optional schema, e.g. main.
+    r"[\"'`\[]?(\w+)",
+    re.IGNORECASE | re.DOTALL,
+)
+
 
 def log(msg):
     """Write a message to stderr with the tool prefix."""
     sys.stderr.write(f"{TOOL} {msg}\n")
 
 
-def _is_fts5_trigger(statement_upper):
-    """Check if statement is an internal FTS5 trigger."""
-    if "CREATE TRIGGER" not in statement_upper:
+def _is_fts_shadow_trigger(statement, fts_shadows):
+    """Check if statement creates a trigger on a known FTS shadow table."""
+    if not fts_shadows:
         return False
-    # Regex to find the table name the trigger is ON
-    match = re.search(r"ON\s+[\"']?([a-zA-Z0-9_]+)[\"']?", statement_upper)
-    if match:
-        table_name = match.group(1)
-        if any(
-            table_name.endswith(x)
-            for x in ("_CONTENT", "_DOC", "_CONFIG", "_IDX", "_DATA")
-        ):
-            return True
-    return False
+    match = _TRIGGER_ON_RE.match(statement)
+    return bool(match) and match.group(1).lower() in fts_shadows
 
 
-def _should_suppress_statement(statement, debug=False):
+def _should_suppress_statement(statement, debug=False, fts_shadows=frozenset()):
     """Determine if a SQL statement should be filtered out.
     Extracted from filter_sql_stream to reduce cyclomatic complexity."""
     upper = statement.upper().strip()
@@ -52,7 +78,7 @@ def _should_suppress_statement(statement, debug=False):
     if "PRAGMA WRITABLE_SCHEMA" in upper:
         return True
 
-    if _is_fts5_trigger(upper):
+    if _is_fts_shadow_trigger(statement, fts_shadows):
         if debug:
             log("skipping FTS5 internal trigger")
         return True
@@ -74,40 +100,92 @@ def _should_suppress_statement(statement, debug=False):
     return False
 
 
-def filter_sql_stream(stream, debug=False):
-    """Filter out problematic statements but preserve as much as possible.
-    This filter is standalone and yields its own setup/transaction wrappers."""
-    yield "PRAGMA foreign_keys=OFF;\n"
-    yield "BEGIN TRANSACTION;\n"
+@contextlib.contextmanager
+def _ignore_sigpipe():
+    """Turn SIGPIPE into BrokenPipeError while writing to a child process."""
+    if not hasattr(signal, "SIGPIPE") or (
+        threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+    previous = signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGPIPE, previous)
+
 
+def _needs_custom_collation(statement):
+    """Check if a CREATE statement references a non-builtin collation."""
+    if not _CREATE_RE.match(statement):
+        return False
+    return any(
+        name.upper() not in BUILTIN_COLLATIONS
+        for name in _COLLATE_RE.findall(statement)
+    )
+
+
+def iter_statements(lines):
+    """Group an iterable of lines into complete SQL statements."""
     buffer = []
-    for line in stream:
+    for line in lines:
         buffer.append(line)
-        current_block = "".join(buffer)
+        # Only a line with a ';' can end a statement; skip the join + tokenizer
+        if ";" not in line:
+            continue
 
+        current_block = "".join(buffer)
         if sqlite3.complete_statement(current_block):
-            statement = current_block
+            yield current_block
             buffer = []
 
-            if not _should_suppress_statement(statement, debug):
-                yield statement
-
     if buffer:
         final = "".join(buffer)
         if final.strip():
             yield final
 
+
+def filter_sql_stream(stream, debug=False, fts_shadows=None):
+    """Filter out problematic statements but preserve as much as possible.
+    This filter is standalone and yields its own setup/transaction wrappers.
+    Pass the same fts_shadows set to every stream of one restore, so triggers
+    in the data still match virtual tables created by a separate schema."""
+    yield "PRAGMA foreign_keys=OFF;\n"
+    yield "BEGIN TRANSACTION;\n"
+
+    # Dumps create virtual tables before any trigger, so one pass suffices
+    if fts_shadows is None:
+        fts_shadows = set()
+    for statement in iter_statements(stream):
+        vtab = _FTS_VTAB_RE.match(statement)
+        if vtab:
+            fts_shadows.update(fts_shadow_tables(vtab.group(1).lower(), vtab.group(2)))
+        if not _should_suppress_statement(statement, debug, fts_shadows):
+            yield statement
+
     yield "COMMIT;\n"
 
 
+# How and where DatabaseRestorer rebuilds; see DatabaseRestorer.__init__
+RestoreOptions = namedtuple("RestoreOptions", "cache_dir target fast")
+
+
 class DatabaseRestorer:
     """Handles parsing and restoring of SQLite database from SQL dump."""
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, cache_dir=None, target=None, fast=False):
+        """target=":memory:" rebuilds into an in-memory database, left open as
+        self.conn for callers that only inspect the result (no file, no cache).
+        fast=True skips the rollback journal on disk and fsyncs (FAST_PRAGMAS)."""
+        if target not in (None, ":memory:"):
+            raise ValueError(f"unsupported restore target: {target!r}")
         self.registered_collations = set()
+        self.options = RestoreOptions(cache_dir, target, fast)
         self.tmp_path = None
         self.conn = None
         self.debug = debug
+        self.cached_file = None
+        self.scratch_dir = get_scratch_dir()
 
     def __enter__(self):
         return self
@@ -116,26 +194,182 @@ class DatabaseRestorer:
         self.cleanup()
         if self.conn:
             self.conn.close()
+        if self.cached_file:
+            self.cached_file.close()
 
     def restore(self, sql_script_source):
-        """Restore database from SQL iterator or string with collation discovery."""
+        """Restore database from SQL iterator or string with collation discovery.
+
+        Iterators are consumed lazily and spooled to disk one statement at a
+        time, so peak memory stays O(one statement) rather than O(full dump).
+        """
         if isinstance(sql_script_source, str):
             # Wrap string in a list to make it an iterable of one statement
             sql_script_source = [sql_script_source]
 
-        # Step 1: Stream the SQL to a temporary file
+        # Step 1: Stream the SQL to a temporary file. Meanwhile the sqlite3 shell
+        # executes it speculatively in its own process, overlapping filtering
+        # (Python, GIL-bound) with execution (C) on another core.
         fd_sql, sql_tmp_path = tempfile.mkstemp(
             prefix="sqlite_smudge_sql_", suffix=".sql"
         )
+        # Custom collations can only be registered from Python, and the shell
+        # cannot build into our in-memory connection
+        cli_safe = not self.registered_collations and self.options.target is None
+        cli = self._start_cli() if cli_safe else None
+        # The cache key is hashed as the SQL is spooled, not by re-reading it
+        digest = None
+        if self.options.cache_dir and self.options.target is None:
+            digest = hashlib.sha256()
         try:
-            with os.fdopen(fd_sql, "w", encoding="utf-8") as f_sql:
+            with os.fdopen(fd_sql, "wb") as f_sql, _ignore_sigpipe():
                 for statement in sql_script_source:
-                    f_sql.write(statement)
-
-            return self._restore_loop(sql_tmp_path)
+                    data = statement.encode("utf-8")
+                    f_sql.write(data)
+                    if digest:
+                        digest.update(data)
+                    if cli_safe and _needs_custom_collation(statement):
+                        cli_safe = False
+                        self._abort_cli(cli)
+                        cli = None
+                    if cli:
+                        cli = self._pipe_to_cli(cli, statement)
+
+            # Step 2: Reuse a database already rebuilt from identical SQL
+            cache_path = None
+            if digest:
+                cache_path = os.path.join(
+                    self.options.cache_dir, f"{digest.hexdigest()}.sqlite"
+                )
+                if self._load_from_cache(cache_path):
+                    return True
+
+            # Step 3: Keep the shell's result, else replay through Python
+            success = self._finish_cli(cli) or self._restore_loop(sql_tmp_path)
+            cli = None
+
+            if success and cache_path:
+                self._store_in_cache(cache_path)
+            return success
         finally:
-            if os.path.exists(sql_tmp_path):
-                os.remove(sql_tmp_path)
+            self._abort_cli(cli)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(sql_tmp_path)
+
+    def _load_from_cache(self, cache_path):
+        """Open a cached database; the handle survives concurrent eviction."""
+        try:
+            # Deliberately outlives this call (closed in __exit__): the open handle
+            # keeps the data readable if prune_cache() unlinks the file meanwhile
+            self.cached_file = open(  # noqa: SIM115 pylint: disable=consider-using-with
+                cache_path, "rb"
+            )
+            os.utime(cache_path)  # Mark as recently used
+        except OSError:
+            return False
+        if self.debug:
+            log(f"using cached database: {cache_path}")
+        return True
+
+    def _store_in_cache(self, cache_path):
+        """Atomically publish the rebuilt database into the cache."""
+        tmp_cache_path = None
+        try:
+            # prune_cache() would evict it, and every other entry, right away
+            if os.path.getsize(self.tmp_path) > CACHE_MAX_BYTES:
+                if self.debug:
+                    log("database exceeds the cache size limit; not caching")
+                return
+            os.makedirs(self.options.cache_dir, exist_ok=True)
+            fd, tmp_cache_path = tempfile.mkstemp(
+                dir=self.options.cache_dir, suffix=".tmp"
+            )
+            os.close(fd)
+            shutil.copyfile(self.tmp_path, tmp_cache_path)
+            os.replace(tmp_cache_path, cache_path)
+            prune_cache(self.options.cache_dir)
+        except OSError as e:
+            # The cache is an optimization only; never fail the smudge over it
+            if self.debug:
+                log(f"could not cache database: {e}")
+            if tmp_cache_path:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp_cache_path)
+
+    def _start_cli(self):
+        """Start the sqlite3 binary on a fresh database, reading SQL from a pipe.
+
+        Runs with -bail so any error aborts; the caller then falls back to the
+        Python loop, which knows how to recover from collations and bad input.
+        -safe refuses .shell, .system, ATTACH and the like as a second guard
+        behind restore() never feeding it dot-commands."""
+        cli = shutil.which("sqlite3")
+        if not cli:
+            return None
+
+        self._new_temp_path()
+        cmd = [cli, "-safe", "-bail", "-batch", "-init", os.devnull]
+        if self.options.fast:
+            cmd += ["-cmd", FAST_PRAGMAS]
+        cmd.append(self.tmp_path)
+        if self.debug:
+            log(f"restoring via sqlite3 binary: {' '.join(cmd)}")
+
+        return subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            errors="replace",
+        )
+
+    def _pipe_to_cli(self, proc, statement):
+        """Feed a statement to the shell; returns None once the shell is dropped."""
+        if _DOT_COMMAND_RE.search(statement):
+            # Never let the dump drive the shell; Python rejects these
+            reason = "dot-command in input"
+        elif self._feed_cli(proc, statement):
+            return proc
+        else:
+            reason = "sqlite3 binary bailed early"
+        if self.debug:
+            log(f"{reason}; will retry in Python")
+        self._abort_cli(proc)
+        return None
+
+    @staticmethod
+    def _feed_cli(proc, statement):
+        """Pipe a statement to the shell; False once it has exited (-bail)."""
+        try:
+            proc.stdin.write(statement)
+            return True
+        except OSError:  # BrokenPipeError, or EINVAL on Windows
+            return False
+
+    def _finish_cli(self, proc):
+        """Wait for the shell to execute everything it was fed."""
+        if proc is None:
+            return False
+        with _ignore_sigpipe():
+            _, err = proc.communicate()  # Ignores EPIPE if it bailed mid-stream
+        if proc.returncode == 0:
+            return True
+
+        if self.debug:
+            log(f"sqlite3 binary restore failed ({err.strip()}); retrying in Python")
+        return False
+
+    @staticmethod
+    def _abort_cli(proc):
+        """Stop a speculative shell whose result is no longer wanted."""
+        if proc is None:
+            return
+        proc.kill()
+        with _ignore_sigpipe(), contextlib.suppress(OSError):
+            proc.stdin.close()
+        proc.wait()
+        proc.stderr.close()
 
     def _restore_loop(self, sql_tmp_path):
         """Attempt restoration in a loop to handle dynamic collations."""
@@ -162,7 +396,7 @@ class DatabaseRestorer:
         """Apply SQL from file to current DB connection."""
         try:
             with open(sql_tmp_path, "r", encoding="utf-8") as f_sql:
-                for statement in self._yield_statements(f_sql):
+                for statement in iter_statements(f_sql):
                     if not statement.strip():
                         continue
                     try:
@@ -184,59 +418,88 @@ class DatabaseRestorer:
             return True
 
         e_str = str(e).lower()
+        if "database or disk is full" in e_str and self.scratch_dir:
+            # The RAM-backed scratch dir filled up; retry on the regular tmpdir
+            log(f"warning: {self.scratch_dir} is full; retrying in the temp dir")
+            self.scratch_dir = None
+            return True
+
         if "no such table" in e_str or ("index" in e_str and "already exists" in e_str):
             log(f"warning: ignoring error: {e}")
             return False
 
         raise e
 
-    def _yield_statements(self, file_handle):
-        """Yield full SQL statements from a file handle using robust splitting."""
-        buffer = []
-        for line in file_handle:
-            buffer.append(line)
-            current_block = "".join(buffer)
-            if sqlite3.complete_statement(current_block):
-                yield current_block
-                buffer = []
-        if buffer:
-            final = "".join(buffer)
-            if final.strip():
-                yield final
-
-    def _create_temp_db(self):
-        """Initialize a fresh temporary database with registered collations."""
-        if self.tmp_path and os.path.exists(self.tmp_path):
-            os.remove(self.tmp_path)
+    def _new_temp_path(self):
+        """Replace any previous attempt with a fresh, empty temporary file."""
+        self.cleanup()
 
-        fd, self.tmp_path = tempfile.mkstemp(prefix="sqlite_smudge_", suffix=".sqlite")
+        # The rebuilt DB is read back once and deleted, so keep it in RAM if we can
+        fd, self.tmp_path = tempfile.mkstemp(
+            prefix="sqlite_smudge_", suffix=".sqlite", dir=self.scratch_dir
+        )
         os.close(fd)
 
-        self.conn = sqlite3.connect(self.tmp_path)
+    def _create_temp_db(self):
+        """Initialize a fresh temporary database with registered collations."""
+        if self.options.target is None:
+            self._new_temp_path()
+            self.conn = sqlite3.connect(self.tmp_path)
+        else:
+            self.conn = sqlite3.connect(self.options.target)
+        if self.options.fast:
+            self.conn.executescript(FAST_PRAGMAS)
         for col in self.registered_collations:
             self.conn.create_collation(col, collation_func)
 
     def _ensure_collation(self, error_msg):
         """Discover and register missing collations."""
-        match = re.search(r"no such collation sequence: (\S+)", str(error_msg))
-        if match:
-            col_name = match.group(1).strip("'\"")
-            if col_name not in self.registered_collations:
-                if self.debug:
-                    log(f"registering missing collation: {col_name}")
-                self.registered_collations.add(col_name)
-                return True
-        return False
+        tool_name = TOOL if self.debug else None
+        return register_missing_collation(
+            error_msg, self.registered_collations, tool_name
+        )
 
-    def stream_to_stdout(self):
-        """Output the rebuilt binary database using streaming I/O."""
+    def stream_to_stdout(self, out=None):
+        """Output the rebuilt binary database to out (default: stdout)."""
+        out = sys.stdout.buffer if out is None else out
+        if self.cached_file:
+            copy_stream(self.cached_file, out)
+            return
         with open(self.tmp_path, "rb") as f:
-            shutil.copyfileobj(f, sys.stdout.buffer)
+            copy_stream(f, out)
 
     def cleanup(self):
         """Remove temporary files."""
-        if self.tmp_path and os.path.exists(self.tmp_path):
-            os.remove(self.tmp_path)
+        if self.tmp_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.tmp_path)
+
+
+def restore_database(stream, schema=None, debug=False, out=None):
+    """Rebuild a database from an SQL dump stream and write it to out
+    (a binary stream; default: stdout)."""
+
+    # filter_sql_stream is a generator. We combine it with schema if present.
+    # Never materialize it (list/join): restore() spools it statement by statement.
+    def get_script_iterator():
+        # One FTS shadow-table set spans schema and data
+        fts_shadows = set()
+
+        # Schema (Applied outside transaction to avoid locks/complexity with virtual tables)
+        if schema and os.path.exists(schema):
+            if debug:
+                log(f"loading schema from {schema}")
+            with open(schema, "r", encoding="utf-8") as f:
+                yield from filter_sql_stream(f, debug, fts_shadows)
+
+        # Data (filter_sql_stream provides its own transaction/setup)
+        yield from filter_sql_stream(stream, debug, fts_shadows)
+
+    with DatabaseRestorer(debug=debug, cache_dir=get_cache_dir()) as restorer:
+        if not restorer.restore(get_script_iterator()):
+            return False
+        restorer.stream_to_stdout(out)
+        return True
 
 
 def main():
@@ -254,26 +517,11 @@ def main():
     # Submodule optimization check: Skip smudge if configured to ignore-submodules
     if should_skip_submodule("git-sqlite-smudge"):
         # Fast pass-through: pipe stdin directly to stdout
-        shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+        copy_stream(sys.stdin.buffer, sys.stdout.buffer)
         return
 
-    # filter_sql_stream is a generator. We combine it with schema if present.
-    def get_script_iterator():
-        # Schema (Applied outside transaction to avoid locks/complexity with virtual tables)
-        if args.schema and os.path.exists(args.schema):
-            if debug:
-                log(f"loading schema from {args.schema}")
-            with open(args.schema, "r", encoding="utf-8") as f:
-                yield from filter_sql_stream(f, debug=debug)
-
-        # Data (filter_sql_stream provides its own transaction/setup)
-        yield from filter_sql_stream(sys.stdin, debug=debug)
-
-    with DatabaseRestorer(debug=debug) as restorer:
-        if restorer.restore(get_script_iterator()):
-            restorer.stream_to_stdout()
-        else:
-            sys.exit(1)
+    if not restore_database(sys.stdin, args.schema, debug):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 """Shared utilities for git-sqlite-filter."""
 
+import errno
+import functools
 import os
 import re
+import shutil
 import signal
 import subprocess
 import sys
@@ -10,6 +13,27 @@ import sys
 if hasattr(signal, "SIGPIPE"):
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
+_COLLATION_RE = re.compile(r"no such collation sequence: (\S+)")
+
+# Large chunks mean fewer read/write syscalls when piping whole databases
+COPY_BUFSIZE = 1 << 20
+
+# Upper bound on the restored-database cache before least recently used eviction
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# RAM-backed tmpfs on Linux; scratch files here never touch the disk
+SHM_DIR = "/dev/shm"
+
+# Free space SHM_DIR needs before we use it (Docker's default is only 64 MiB)
+SHM_MIN_FREE = 256 * 1024 * 1024
+
+# Shadow tables each FTS module creates alongside its virtual table
+FTS_SHADOW_SUFFIXES = {
+    "FTS5": ("_data", "_idx", "_content", "_docsize", "_config"),
+    "FTS4": ("_content", "_segments", "_segdir", "_docsize", "_stat"),
+    "FTS3": ("_content", "_segments", "_segdir", "_docsize", "_stat"),
+}
+
 
 def get_common_args(parser):
     """Add common arguments to the CLI parser."""
@@ -28,17 +52,154 @@ def collation_func(s1, s2):
 
 def extract_missing_collation(error_msg):
     """Extract collation name from an SQLite OperationalError message."""
-    match = re.search(r"no such collation sequence: (\S+)", str(error_msg))
+    match = _COLLATION_RE.search(str(error_msg))
     if match:
         return match.group(1).strip("'\"")
     return None
 
 
+def register_missing_collation(error_msg, registered, tool_name=None):
+    """Add the collation an OperationalError names to the registered set.
+    Returns True if it was new (worth a retry); logs it when tool_name is given."""
+    col_name = extract_missing_collation(error_msg)
+    if not col_name or col_name in registered:
+        return False
+    if tool_name:
+        log(tool_name, f"registering missing collation: {col_name}")
+    registered.add(col_name)
+    return True
+
+
+def copy_stream(src, dst):
+    """Copy a binary stream to another (zero-copy via os.splice where possible).
+
+    src must not have been partially read through its buffer, since splice
+    works on the underlying file descriptor."""
+    if hasattr(os, "splice"):
+        try:
+            in_fd, out_fd = src.fileno(), dst.fileno()
+        except (AttributeError, OSError, ValueError):
+            pass  # In-memory streams (e.g. tests) have no file descriptor
+        else:
+            dst.flush()
+            try:
+                while os.splice(in_fd, out_fd, COPY_BUFSIZE, flags=os.SPLICE_F_MORE):
+                    pass
+                return
+            except OSError as e:
+                # EINVAL: neither side is a pipe; use a regular copy instead
+                if e.errno != errno.EINVAL:
+                    raise
+    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+
+def get_cache_dir():
+    """Return the restored-database cache directory, or None if disabled.
+
+    GIT_SQLITE_FILTER_CACHE_DIR overrides the location; set it empty to disable."""
+    override = os.environ.get("GIT_SQLITE_FILTER_CACHE_DIR")
+    if override is not None:
+        return override or None
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "git-sqlite-filter")
+
+
+def prune_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """Evict least recently used cache entries until the total fits max_bytes.
+
+    Leftover .tmp files from interrupted stores count (and go) too."""
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith((".sqlite", ".tmp")) and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # Evicted concurrently by another filter process
+        total -= size
+
+
+def get_scratch_dir(min_free=SHM_MIN_FREE):
+    """Return a RAM-backed directory for short-lived files, or None for default.
+
+    Small tmpfs mounts are skipped, since a full one fails the whole restore."""
+    if not (os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK | os.X_OK)):
+        return None
+    try:
+        st = os.statvfs(SHM_DIR)
+    except OSError:
+        return None
+    return SHM_DIR if st.f_bavail * st.f_frsize >= min_free else None
+
+
+@functools.lru_cache(maxsize=None)
+def load_pygit2():
+    """Import the optional pygit2 on first use (~75 ms); None if not installed.
+
+    Only the submodule checks need it, so plain repositories never pay for it."""
+    try:
+        import pygit2  # pylint: disable=import-outside-toplevel
+    except ImportError:  # Optional: read git config in-process instead of forking git
+        return None
+    return pygit2
+
+
+def _open_repo(path):
+    """Open the repository containing path with pygit2, or None if unavailable."""
+    pygit2 = load_pygit2()
+    if pygit2 is None:
+        return None
+    try:
+        git_dir = pygit2.discover_repository(path)
+        return pygit2.Repository(git_dir) if git_dir else None
+    except (pygit2.GitError, ValueError):
+        return None
+
+
+def _superproject_root_pygit2():
+    """Find the superproject via libgit2; returns "" when it cannot decide."""
+    repo = _open_repo(".")
+    if repo is None or repo.workdir is None:
+        return ""
+    workdir = os.path.normpath(repo.workdir)
+    parent = _open_repo(os.path.dirname(workdir))
+    if parent is None or parent.workdir is None:
+        return None
+
+    # Like git rev-parse, require a gitlink entry for us in the parent's index
+    pygit2 = load_pygit2()
+    super_root = os.path.normpath(parent.workdir)
+    rel = os.path.relpath(workdir, super_root).replace(os.sep, "/")
+    try:
+        entry = parent.index[rel]
+    except (KeyError, pygit2.GitError):
+        return None
+    return super_root if entry.mode == pygit2.GIT_FILEMODE_COMMIT else None
+
+
+def fts_shadow_tables(name, module):
+    """Return the shadow table names an FTS virtual table owns (empty if not FTS)."""
+    return {f"{name}{suffix}" for suffix in FTS_SHADOW_SUFFIXES.get(module.upper(), ())}
+
+
 def get_superproject_root():
     """Get the root of the superproject if we are in a submodule."""
     if not os.path.exists(".git") or not os.path.isfile(".git"):
         return None
 
+    super_root = _superproject_root_pygit2()
+    if super_root != "":
+        return super_root
+
     try:
         out = subprocess.check_output(
             ["git", "rev-parse", "--show-superproject-working-tree"],
@@ -53,6 +214,15 @@ def get_superproject_root():
 
 def get_git_config_bool(key, cwd=None):
     """Get a git config boolean value (true/false) handling various formats."""
+    repo = _open_repo(cwd or ".")
+    if repo is not None:
+        try:
+            return repo.config.get_bool(key)
+        except KeyError:
+            return False
+        except load_pygit2().GitError:
+            pass  # Unparseable value; let git report it the usual way
+
     try:
         cmd = ["git"]
         if cwd:
@@ -0,0 +1,22 @@
+"""cffi (ABI mode) declarations for the subset of NSS used by nss_native."""
+
+from cffi import FFI
+
+ffi = FFI()
+
+ffi.cdef("""
+    typedef struct {
+        unsigned int type;
+        unsigned char *data;
+        unsigned int len;
+    } SECItem;
+
+    int NSS_Init(const char *configdir);
+    int NSS_Shutdown(void);
+
+    void *PK11_GetInternalKeySlot(void);
+    int PK11_CheckUserPassword(void *slot, const char *pw);
+
+    int PK11SDR_Decrypt(SECItem *data, SECItem *result, void *cx);
+    void SECITEM_FreeItem(SECItem *zap, int freeit);
+    """)
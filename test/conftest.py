@@ -1,8 +1,12 @@
 """Pytest configuration and shared fixtures."""
 
+import os
 import sys
 from pathlib import Path
 
 # Add src to sys.path so tests can import git_sqlite_filter
 src_path = Path(__file__).parent.parent / "src"
 sys.path.insert(0, str(src_path))
+
+# Keep the smudge cache out of the developer's ~/.cache; tests opt in explicitly
+os.environ["GIT_SQLITE_FILTER_CACHE_DIR"] = ""
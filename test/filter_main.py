@@ -0,0 +1,30 @@
+"""Run the filters' CLI entry points in-process for tests."""
+
+import contextlib
+import io
+import sys
+from unittest import mock
+
+
+def invoke_main(main_func, argv, stdin_bytes=b""):
+    """
+    Call a filter's main() with patched argv/stdin/stdout/stderr.
+    Returns (returncode, stdout bytes, stderr text), like subprocess.run.
+    """
+    out = io.BytesIO()
+    # Text layer over bytes so both sys.stdout.write and sys.stdout.buffer work
+    stdout = io.TextIOWrapper(out, encoding="utf-8", write_through=True)
+    stdin = io.TextIOWrapper(io.BytesIO(stdin_bytes), encoding="utf-8")
+    stderr = io.StringIO()
+
+    returncode = 0
+    with mock.patch.object(sys, "argv", argv), mock.patch.object(
+        sys, "stdin", stdin
+    ), contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            main_func()
+        except SystemExit as e:
+            if e.code is not None:
+                returncode = e.code if isinstance(e.code, int) else 1
+    stdout.flush()
+    return returncode, out.getvalue(), stderr.getvalue()
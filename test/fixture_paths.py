@@ -0,0 +1,22 @@
+"""Fixture database locations shared by the test modules."""
+
+import os
+
+FIXTURE_DIR = "test/fixtures"
+
+# Databases built by generate_fixture_dbs.py. Listed explicitly (not globbed) so
+# stray/corrupt files never get parametrized; built once at import.
+FIXTURE_DBS = tuple(
+    os.path.join(FIXTURE_DIR, name)
+    for name in (
+        "version_0.db",
+        "version_huge.db",
+        "collation_edge.db",
+        "blobs.db",
+        "fts.db",
+        "generated_cols.db",
+        "constraints.db",
+        "autoincrement.db",
+        "mixed_edge.db",
+    )
+)
@@ -1,20 +1,49 @@
-import shutil
 from pathlib import Path
 
+# Import ffpass and its crypto/ASN.1 stack once at collection time, so no
+# individual test pays the import cost inside its timing
+import Crypto.Cipher.AES  # type: ignore  # noqa: F401
+import ffpass  # type: ignore  # noqa: F401
+import pyasn1.codec.der.decoder  # type: ignore
+import pyasn1.codec.der.encoder  # type: ignore
+import pyasn1.type.univ  # type: ignore  # noqa: F401
 import pytest
 
+from .ffpass_utils import clone_profile, get_native_logins
+
+# Under pytest-xdist (see README.rst) each worker imports this once, and
+# clean_profile clones into that test's own tmp_path, so files never collide
 
 @pytest.fixture
 def clean_profile(tmp_path):
     """
-    Copies the requested profile to a temporary directory and returns
-    the path to the new copy.
+    Clones the requested profile into a temporary directory and returns
+    the path to the new copy. Read-only files are hardlinked rather than
+    copied; files that tests mutate are real copies so the originals
+    never change.
     """
 
     def _setup(profile_name):
         src = Path("test/fixtures/ff_tests") / profile_name
-        dst = tmp_path / profile_name
-        shutil.copytree(src, dst, dirs_exist_ok=True)
-        return dst
+        return clone_profile(src, tmp_path / profile_name)
 
     return _setup
+
+
+@pytest.fixture(scope="session")
+def native_logins(tmp_path_factory):
+    """
+    Returns get(profile_name, password): native NSS logins for a profile,
+    cloned and decrypted at most once per session.
+    """
+    cache = {}
+
+    def get(profile_name, password):
+        key = (profile_name, password)
+        if key not in cache:
+            src = Path("test/fixtures/ff_tests") / profile_name
+            dst = clone_profile(src, tmp_path_factory.mktemp("native") / profile_name)
+            cache[key] = get_native_logins(str(dst), password)
+        return cache[key]
+
+    return get
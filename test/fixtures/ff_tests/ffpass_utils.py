@@ -1,10 +1,43 @@
+import io
 import logging
+import os
+import shutil
+from contextlib import ExitStack, contextmanager
+from unittest.mock import patch
+
+# Files ffpass rewrites in place; these get real copies instead of hardlinks
+MUTABLE_FILES = ("logins.json",)
+
+
+def _link_or_copy(src, dst):
+    """Hardlink a fixture file, falling back to a copy across filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def clone_profile(src, dst, writable=MUTABLE_FILES):
+    """
+    Clones a profile directory: files are hardlinked to the (never modified)
+    fixtures, except those named in `writable`, which are real copies so a
+    test writing to them can't reach the originals.
+    """
+    shutil.copytree(src, dst, copy_function=_link_or_copy, dirs_exist_ok=True)
+    for name in writable:
+        path = dst / name
+        if path.exists():
+            path.unlink()
+            shutil.copy2(src / name, path)
+    return dst
 
 
 def get_native_logins(directory, password) -> "list | None":
     """
-    Attempts to decrypt logins using safe, native NSS interactions via ctypes.
+    Attempts to decrypt logins using safe, native NSS interactions via cffi
+    (the binding lives in test/_nss_cffi.py).
     Returns list of logins or None/Empty list on failure.
+    Not memoized here; the session-scoped native_logins fixture caches results.
     """
     try:
         try:
@@ -17,5 +50,21 @@ def get_native_logins(directory, password) -> "list | None":
 
         return decrypt_logins_native(directory, password)
     except Exception as e:
-        logging.debug(f"Native decryption attempt failed: {e}")
+        logging.debug("Native decryption attempt failed: %s", e)
         return None
+
+
+@contextmanager
+def ffpass_env(argv, stdin_text="", **mocks):
+    """
+    Runs the block as `ffpass <argv...>` with stdin_text on stdin, each keyword
+    replacing the ffpass attribute of that name. Yields the captured stdout.
+    """
+    stdout = io.StringIO()
+    with ExitStack() as stack:
+        stack.enter_context(patch("sys.argv", argv))
+        stack.enter_context(patch("sys.stdin", io.StringIO(stdin_text)))
+        stack.enter_context(patch("sys.stdout", stdout))
+        for name, value in mocks.items():
+            stack.enter_context(patch(f"ffpass.{name}", value))
+        yield stdout
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
-import shutil
 import sqlite3
+from functools import lru_cache
 from pathlib import Path
 
 import pytest
 
 import ffpass  # type: ignore
 
+from .ffpass_utils import clone_profile
+
 # This key corresponds to the static 'tests/firefox-84' profile in your repo
 TEST_KEY = (
     b"\xbfh\x13\x1a\xda\xb5\x9d\xe3X\x10\xe0\xa8\x8a\xc2\xe5\xbcE\xf2I\r\xa2pm\xf4"
@@ -16,11 +18,21 @@ MASTER_PASSWORD = "test"
 MAGIC1 = b"\xf8\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01"
 
 
+@lru_cache(maxsize=None)
+def _cached_get_all_keys(directory, password, mtime_ns):
+    """
+    get_all_keys() re-runs PBKDF2 and decryption on every call; its result only
+    depends on key4.db, whose mtime is part of the cache key.
+    """
+    return ffpass.get_all_keys(Path(directory), password)
+
+
 def _get_key(directory, password=""):
     """
     Helper to adapt the new get_all_keys API to legacy test expectations.
     """
-    keys, _ = ffpass.get_all_keys(directory, password)
+    mtime_ns = (Path(directory) / "key4.db").stat().st_mtime_ns
+    keys, _ = _cached_get_all_keys(str(directory), password, mtime_ns)
     # Simulate askpass logic: prefer 32-byte key, else first found
     best = next((k for k in keys if len(k) == 32), keys[0])
     return best
@@ -36,12 +48,17 @@ def mixed_key_profile(tmp_path):
     # 1. Base the profile on an existing valid one
     src = Path("test/fixtures/ff_tests/firefox-84")
     dst = tmp_path / "firefox-mixed"
-    shutil.copytree(src, dst)
+    # key4.db is rewritten below, so it must not stay hardlinked to the fixture
+    clone_profile(src, dst, writable=("key4.db",))
 
-    # 2. Open the DB
+    # 2. Load the DB into memory; it is written back once, via backup()
     db_path = dst / "key4.db"
-    # Use context manager to ensure connection closes even on error
-    with sqlite3.connect(str(db_path)) as conn:
+    conn = sqlite3.connect(":memory:")
+    with sqlite3.connect(str(db_path)) as disk:
+        disk.backup(conn)
+    disk.close()
+
+    try:
         c = conn.cursor()
 
         # 3. Fetch the existing key row
@@ -70,12 +87,35 @@ def mixed_key_profile(tmp_path):
             placeholders = ",".join(["?"] * len(row_list))
             c.execute(f"INSERT INTO nssPrivate VALUES ({placeholders})", row_list)
             conn.commit()
+
+        disk = sqlite3.connect(str(db_path))
+        disk.execute("PRAGMA journal_mode=OFF")
+        disk.execute("PRAGMA synchronous=OFF")
+        conn.backup(disk)
+        disk.close()
+    finally:
+        conn.close()
     return dst
 
 
-def test_firefox_key():
-    key = _get_key(Path("test/fixtures/ff_tests/firefox-84"))
-    assert key == TEST_KEY
+@pytest.fixture(scope="module")
+def firefox_84_key():
+    """
+    Derives the firefox-84 key once for every test in this module.
+    """
+    return _get_key(Path("test/fixtures/ff_tests/firefox-84"))
+
+
+@pytest.fixture(scope="module")
+def firefox_70_key():
+    """
+    Derives the legacy firefox-70 key once for every test in this module.
+    """
+    return _get_key(Path("test/fixtures/ff_tests/firefox-70"))
+
+
+def test_firefox_key(firefox_84_key):
+    assert firefox_84_key == TEST_KEY
 
 
 def test_firefox_mp_key():
@@ -88,9 +128,8 @@ def test_firefox_wrong_masterpassword_key():
         _get_key(Path("test/fixtures/ff_tests/firefox-mp-84"), "wrongpassword")
 
 
-def test_legacy_firefox_key():
-    key = _get_key(Path("test/fixtures/ff_tests/firefox-70"))
-    assert key == TEST_KEY
+def test_legacy_firefox_key(firefox_70_key):
+    assert firefox_70_key == TEST_KEY
 
 
 def test_legacy_firefox_mp_key():
@@ -6,70 +6,66 @@ Created on Fri Dec 25 19:30:48 2025
 @author: shane
 """
 
-from unittest.mock import patch
+from unittest.mock import MagicMock
 
 from ffpass import main  # type: ignore
 
+from .ffpass_utils import ffpass_env
+
 HEADER = "url,username,password"
 EXPECTED_MIXED_OUTPUT = [HEADER, "http://www.mixedkeys.com,modern_user,modern_pass"]
 
+# Simulated keys: Legacy (24 bytes) and Modern (32 bytes)
+LEGACY_KEY = b"L" * 24
+MODERN_KEY = b"M" * 32
+# Golden key check result per key; only the modern key decrypts
+KEY_TO_RESULT = {MODERN_KEY: ("valid_utf8", "AES-Standard")}
+
 
 def run_ffpass_internal(mode, path):
 
     test_args = ["ffpass", mode, "-d", str(path)]
 
+    # 1. Mock Key Return
+    # Simulate finding two keys: Legacy and Modern
     # We patch get_all_keys directly to avoid the infinite loop issue
     # and avoid needing complex ASN.1 mocking for the password check.
-    with patch("sys.argv", test_args), \
-         patch("sys.stdin.isatty", return_value=False), \
-         patch("sys.stdin.readline", return_value=""), \
-         patch("ffpass.get_all_keys") as mock_get_keys, \
-         patch("ffpass.try_decrypt_login") as mock_decrypt_login:
-
-        # 1. Mock Key Return
-        # Simulate finding two keys: Legacy (24 bytes) and Modern (32 bytes)
-        mock_get_keys.return_value = ([b"L" * 24, b"M" * 32], b"salt")
-
-        # 2. Mock Golden Key Check
-        # Verify the tool checks if the key works on the first row
-        def try_login_side_effect(key, ct, iv):
-            if key == b"M" * 32:
-                return "valid_utf8", "AES-Standard"
-            return None, None
-
-        mock_decrypt_login.side_effect = try_login_side_effect
-
-        # 3. Mock Final Decryption
-        with patch("ffpass.decodeLoginData") as mock_decode:
-            # Use iterator to return user then pass
-            return_values = iter(["modern_user", "modern_pass"])
-
-            def decode_side_effect(key, data):
-                if len(key) == 32:
-                    try:
-                        return next(return_values)
-                    except StopIteration:
-                        return "extra"
-                raise ValueError("Wrong Key")
-
-            mock_decode.side_effect = decode_side_effect
-
-            # Capture stdout
-            from io import StringIO
-            import contextlib
-
-            captured_output = StringIO()
-            with contextlib.redirect_stdout(captured_output):
-                try:
-                    main()
-                except SystemExit:
-                    pass
-
-            return captured_output.getvalue()
+    mock_get_keys = MagicMock(return_value=([LEGACY_KEY, MODERN_KEY], b"salt"))
+
+    # 2. Mock Golden Key Check
+    # Verify the tool checks if the key works on the first row
+    def try_login_side_effect(key, ct, iv):
+        return KEY_TO_RESULT.get(key, (None, None))
+
+    # 3. Mock Final Decryption
+    # Use iterator to return user then pass
+    return_values = iter(["modern_user", "modern_pass"])
+
+    def decode_side_effect(key, data):
+        if len(key) == len(MODERN_KEY):
+            try:
+                return next(return_values)
+            except StopIteration:
+                return "extra"
+        raise ValueError("Wrong Key")
+
+    # Empty, non-tty stdin: no password prompt input
+    with ffpass_env(
+        test_args,
+        get_all_keys=mock_get_keys,
+        try_decrypt_login=MagicMock(side_effect=try_login_side_effect),
+        decodeLoginData=MagicMock(side_effect=decode_side_effect),
+    ) as captured_output:
+        try:
+            main()
+        except SystemExit:
+            pass
+
+    return captured_output.getvalue()
 
 
 def stdout_splitter(input_text):
-    return [x for x in input_text.splitlines() if x != ""]
+    return list(filter(None, input_text.splitlines()))
 
 
 def test_mixed_key_rotation_export(clean_profile):
@@ -6,11 +6,9 @@ Created on Fri Dec 26 00:13:51 2025
 @author: shane
 """
 
-import shutil
 import sys
-from io import StringIO
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock
 
 import pytest
 
@@ -20,6 +18,8 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 import ffpass  # type: ignore  # noqa: E402
 from ffpass import main  # noqa: E402
 
+from .ffpass_utils import clone_profile, ffpass_env
+
 MASTER_PASSWORD = "password123"
 
 
@@ -34,26 +34,22 @@ def mp_profile(tmp_path):
         pytest.fail(
             "Run scripts/generate_mp_profile.py first to generate real crypto assets"
         )
-    dst = tmp_path / "firefox-mp-test"
-    shutil.copytree(src, dst)
-    return dst
+    # The import test rewrites logins.json, which clone_profile copies for real
+    return clone_profile(src, tmp_path / "firefox-mp-test")
 
 
-@patch.object(ffpass, "getpass")
-def test_export_with_correct_password(mock_getpass, mp_profile):
+def test_export_with_correct_password(mp_profile):
     """
     Verifies that providing the correct password via stdin allows
     successful decryption of the database.
     """
     # Mock user input to return correct password immediately
-    mock_getpass.return_value = MASTER_PASSWORD
+    mock_getpass = MagicMock(return_value=MASTER_PASSWORD)
 
     # Capture stdout to verify CSV output
-    capture = StringIO()
-
-    with patch("sys.argv", ["ffpass", "export", "-d", str(mp_profile)]), patch(
-        "sys.stdout", capture
-    ):
+    with ffpass_env(
+        ["ffpass", "export", "-d", str(mp_profile)], getpass=mock_getpass
+    ) as capture:
 
         # Run real main() - no internal crypto mocks!
         # This proves verify_password -> decrypt_key -> decodeLoginData all work
@@ -75,63 +71,71 @@ def test_export_with_wrong_password_retry(mp_profile):
     Verifies the retry logic:
     1. Enter wrong password -> fail
     2. Enter correct password -> succeed
+
+    verify_password is mocked so the rejected attempt costs no KDF work;
+    real decryption with the correct password is covered by
+    test_export_with_correct_password (and still runs once here).
     """
     # Create an iterator that yields Wrong, then Right
     # This simulates the user typing correctly on the second attempt
     inputs = iter(["wrong_pass", MASTER_PASSWORD])
+    mock_verify = MagicMock(side_effect=[False, True])
 
-    with patch.object(ffpass, "getpass", side_effect=lambda x: next(inputs)):
-        capture = StringIO()
+    with ffpass_env(
+        ["ffpass", "export", "-d", str(mp_profile)],
+        getpass=MagicMock(side_effect=lambda x: next(inputs)),
+        verify_password=mock_verify,
+    ) as capture:
 
-        with patch("sys.argv", ["ffpass", "export", "-d", str(mp_profile)]), patch(
-            "sys.stdout", capture
-        ):
+        try:
+            main()
+        except (SystemExit, KeyboardInterrupt):
+            pass
 
-            try:
-                main()
-            except (SystemExit, KeyboardInterrupt):
-                pass
+    output = capture.getvalue()
 
-        output = capture.getvalue()
+    # Prompted twice, and the second (accepted) attempt used the right password
+    assert mock_verify.call_count == 2
+    assert MASTER_PASSWORD in mock_verify.call_args_list[1].args
 
-        # It should eventually succeed and print the data
-        assert "secret_user" in output
+    # It should eventually succeed and print the data
+    assert "secret_user" in output
 
 
 def test_import_with_stdin_password(mp_profile):
     """
     Verifies that import also respects the password prompt mechanism.
     """
-    with patch.object(ffpass, "getpass", return_value=MASTER_PASSWORD):
-        # Prepare input CSV for import
-        input_csv = "url,username,password\nhttps://newsite.com,new_user,new_pass"
-
-        # We need to mock stdin for the CSV data itself
-        # AND mock ffpass.getpass for the master password
-
-        # ffpass.main_import reads from args.file.
-        # If args.file is sys.stdin, we must patch sys.stdin.
-
-        with patch("sys.argv", ["ffpass", "import", "-d", str(mp_profile)]), patch(
-            "sys.stdin", StringIO(input_csv)
-        ):
-
-            try:
-                main()
-            except SystemExit:
-                pass
+    # Prepare input CSV for import
+    input_csv = "url,username,password\nhttps://newsite.com,new_user,new_pass"
+
+    # We need to mock stdin for the CSV data itself
+    # AND mock ffpass.getpass for the master password
+
+    # ffpass.main_import reads from args.file.
+    # If args.file is sys.stdin, we must patch sys.stdin.
+    # Spy on the logins.json writer to see what was saved, without re-reading it
+    save_spy = MagicMock(wraps=ffpass.dumpJsonLogins)
+    with ffpass_env(
+        ["ffpass", "import", "-d", str(mp_profile)],
+        input_csv,
+        getpass=MagicMock(return_value=MASTER_PASSWORD),
+        dumpJsonLogins=save_spy,
+    ):
 
-        # Verify the new login was actually added to the file
-        # We can check by running export again or inspecting the JSON
-        import json
+        try:
+            main()
+        except SystemExit:
+            pass
 
-        with open(mp_profile / "logins.json", "r") as f:
-            data = json.load(f)
+    # Verify the new login was actually added to the file
+    save_spy.assert_called_once()
+    _, data = save_spy.call_args.args
 
-        # The file is encrypted, so we can't grep "new_user" directly.
-        # We just check that the login count increased (was 1, now 2)
-        assert len(data["logins"]) == 2
-        assert data["nextId"] == 3
+    # The logins are encrypted, so we can't grep "new_user" directly.
+    # We just check that the login count increased (was 1, now 2)
+    assert len(data["logins"]) == 2
+    assert data["nextId"] == 3
 
 
 if __name__ == "__main__":
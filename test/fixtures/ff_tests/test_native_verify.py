@@ -2,14 +2,11 @@ import sys
 
 import pytest
 
-from .ffpass_utils import get_native_logins
 
-
-def test_native_old_profile(clean_profile):
+def test_native_old_profile(native_logins):
     # Firefox 70 profile (legacy)
-    profile = clean_profile("firefox-70")
     # Password 'test' (from test_run.py)
-    logins = get_native_logins(str(profile), "test")
+    logins = native_logins("firefox-70", "test")
 
     assert len(logins) > 0
 
@@ -24,11 +21,10 @@ def test_native_old_profile(clean_profile):
     assert found, "Expected login not found in native export"
 
 
-def test_native_new_profile(clean_profile):
+def test_native_new_profile(native_logins):
     # Firefox 14-byte IV profile (from user)
-    profile = clean_profile("firefox-14iv")
     # Password 'pass'
-    logins = get_native_logins(str(profile), "pass")
+    logins = native_logins("firefox-14iv", "pass")
 
     assert len(logins) > 0
 
@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
-import sys
+import contextlib
+import io
+import os
 import subprocess
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from ffpass import main  # type: ignore
 
 MASTER_PASSWORD = "test"
 HEADER = "url,username,password"
@@ -11,21 +18,43 @@ EXPECTED_IMPORT_OUTPUT = EXPECTED_EXPORT_OUTPUT + [IMPORT_CREDENTIAL]
 
 
 def run_ffpass_cmd(mode, path):
-    command = [sys.executable, "-c", "from ffpass import main; main()", mode, "--debug", "--dir", str(path)]
+    # Run main() in-process: a subprocess per call paid interpreter and crypto
+    # import startup
+    # No --debug: it was the bulk of the stderr volume, and no test reads stderr
+    args = ["ffpass", mode, "--dir", str(path)]
 
     if mode == "import":
-        ffpass_input = "\n".join([HEADER, IMPORT_CREDENTIAL])
+        ffpass_input = f"{HEADER}\n{IMPORT_CREDENTIAL}"
     else:
         # Pass password via stdin to avoid interactive prompt hang and verify pipe support
         ffpass_input = MASTER_PASSWORD
 
-    return subprocess.run(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, input=ffpass_input, encoding="utf-8"
+    stdout = io.StringIO()
+    returncode = 0
+    with contextlib.ExitStack() as stack:
+        devnull = stack.enter_context(open(os.devnull, "w"))
+        stack.enter_context(patch("sys.argv", args))
+        stack.enter_context(patch("sys.stdin", io.StringIO(ffpass_input)))
+        stack.enter_context(contextlib.redirect_stdout(stdout))
+        stack.enter_context(contextlib.redirect_stderr(devnull))
+        try:
+            main()
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+
+    def check_returncode():
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, args, stdout.getvalue())
+
+    return SimpleNamespace(
+        stdout=stdout.getvalue(),
+        returncode=returncode,
+        check_returncode=check_returncode,
     )
 
 
 def stdout_splitter(input_text):
-    return [x for x in input_text.splitlines()]
+    return input_text.splitlines()
 
 
 def test_legacy_firefox_export(clean_profile):
@@ -49,32 +78,11 @@ def test_firefox_aes_export(clean_profile):
     assert stdout_splitter(r.stdout) == EXPECTED_EXPORT_OUTPUT
 
 
-def test_legacy_firefox(clean_profile):
-    profile_path = clean_profile("firefox-70")
-
-    # modifies the temp file, not the original
-    r = run_ffpass_cmd("import", profile_path)
-    r.check_returncode()
-
-    r = run_ffpass_cmd("export", profile_path)
-    r.check_returncode()
-    assert stdout_splitter(r.stdout) == EXPECTED_IMPORT_OUTPUT
-
-
-def test_firefox(clean_profile):
-    profile_path = clean_profile("firefox-84")
-
-    r = run_ffpass_cmd("import", profile_path)
-    r.check_returncode()
-
-    r = run_ffpass_cmd("export", profile_path)
-    r.check_returncode()
-    assert stdout_splitter(r.stdout) == EXPECTED_IMPORT_OUTPUT
-
-
-def test_firefox_aes(clean_profile):
-    profile_path = clean_profile("firefox-146-aes")
+@pytest.mark.parametrize("profile", ["firefox-70", "firefox-84", "firefox-146-aes"])
+def test_import_export_round_trip(clean_profile, profile):
+    profile_path = clean_profile(profile)
 
+    # modifies the temp file, not the original; both passes share this interpreter
     r = run_ffpass_cmd("import", profile_path)
     r.check_returncode()
 
@@ -2,11 +2,11 @@
 
 import os
 import sqlite3
+from functools import lru_cache
 from hashlib import pbkdf2_hmac, sha1, sha256
 
+import pytest
 from Crypto.Cipher import AES  # type: ignore
-from pyasn1.codec.der.encoder import encode as der_encode  # type: ignore
-from pyasn1.type.univ import Integer, ObjectIdentifier, OctetString, Sequence  # type: ignore
 
 import ffpass  # type: ignore
 
@@ -15,19 +15,24 @@ OID_PBES2 = (1, 2, 840, 113_549, 1, 5, 13)
 OID_PBKDF2 = (1, 2, 840, 113_549, 1, 5, 12)
 OID_AES256_CBC = (2, 16, 840, 1, 101, 3, 4, 1, 42)
 
+# Fixed salts: the test only needs valid crypto, and fixed inputs let derive_key()
+# hit its cache
+GLOBAL_SALT = b"\x01" * 20
+ENTRY_SALT = b"\x02" * 20
+
 
 def PKCS7pad(b, block_size=8):
     pad_len = (-len(b) - 1) % block_size + 1
     return b + bytes([pad_len] * pad_len)
 
 
-def build_pbes2_sequence(
-    global_salt, master_password, entry_salt, iters, plaintext, hash_method="sha256"
+@lru_cache(maxsize=32)
+def derive_key(
+    global_salt, master_password, entry_salt, iters, hash_method="sha256", key_len=32
 ):
     """
-    Constructs a DER-encoded PBES2 sequence just like Firefox/ffpass expects.
+    PBKDF2 dominates this helper, so memoize it across entries and tests.
     """
-    # 1. Derive Key
     if hash_method == "sha1":
         enc_pwd = sha1(global_salt + master_password.encode("utf-8")).digest()
     elif hash_method == "sha256":
@@ -37,8 +42,20 @@ def build_pbes2_sequence(
     else:
         raise ValueError(f"Unknown hash method: {hash_method}")
 
+    return pbkdf2_hmac("sha256", enc_pwd, entry_salt, iters, dklen=key_len)
+
+
+def build_pbes2_sequence(
+    global_salt, master_password, entry_salt, iters, plaintext, hash_method="sha256"
+):
+    """
+    Constructs a DER-encoded PBES2 sequence just like Firefox/ffpass expects.
+    """
+    # 1. Derive Key
     key_len = 32
-    k = pbkdf2_hmac("sha256", enc_pwd, entry_salt, iters, dklen=key_len)
+    k = derive_key(
+        global_salt, master_password, entry_salt, iters, hash_method, key_len
+    )
 
     # 2. Encrypt
     iv = os.urandom(16)
@@ -46,136 +63,117 @@ def build_pbes2_sequence(
     ciphertext = cipher.encrypt(PKCS7pad(plaintext, block_size=16))
 
     # 3. Build ASN.1 Structure
-    # ... (rest is same)
-    # Re-using previous logic structure but just checking it matches
+    return encode_pbes2(entry_salt, iters, key_len, iv, ciphertext)
 
-    # Key Derivation Func
-    kdf_params = Sequence()
-    kdf_params.setComponentByPosition(0, OctetString(entry_salt))
-    kdf_params.setComponentByPosition(1, Integer(iters))
-    kdf_params.setComponentByPosition(2, Integer(key_len))
-
-    # Add PRF OID (AlgorithmIdentifier)
-    # 1.2.840.113549.2.9 = hmacWithSHA256
-    alg_id_prf = Sequence()
-    alg_id_prf.setComponentByPosition(0, ObjectIdentifier((1, 2, 840, 113_549, 2, 9)))
-    # Parameters matches NULL usually or excluded? Let's check spec or assume explicit NULL is safe or omitted.
-    # ffpass logic checks len(pbkdf2_params) > 3. So we must add it as 4th element.
-    kdf_params.setComponentByPosition(3, alg_id_prf)
-
-    kdf = Sequence()
-    kdf.setComponentByPosition(0, ObjectIdentifier(OID_PBKDF2))
-    kdf.setComponentByPosition(1, kdf_params)
-
-    # Encryption Scheme
-    enc_scheme = Sequence()
-    enc_scheme.setComponentByPosition(0, ObjectIdentifier(OID_AES256_CBC))
-    enc_scheme.setComponentByPosition(1, OctetString(iv))
 
-    pbes2_seq = Sequence()
-    pbes2_seq.setComponentByPosition(0, kdf)
-    pbes2_seq.setComponentByPosition(1, enc_scheme)
+def _der_len(n):
+    if n < 0x80:
+        return bytes([n])
+    body = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(body)]) + body
 
-    alg_id = Sequence()
-    alg_id.setComponentByPosition(0, ObjectIdentifier(OID_PBES2))
-    alg_id.setComponentByPosition(1, pbes2_seq)
 
-    top = Sequence()
-    top.setComponentByPosition(0, alg_id)
-    top.setComponentByPosition(1, OctetString(ciphertext))
+def _der_tlv(tag, body):
+    return bytes([tag]) + _der_len(len(body)) + body
 
-    return der_encode(top)
 
+def der_seq(*children):
+    return _der_tlv(0x30, b"".join(children))
 
-def test_plaintext_decryption(tmp_path):
-    print("Setting up test_plaintext_decryption...")
-    db_path = tmp_path / "key4.db"
 
-    if db_path.exists():
-        os.remove(db_path)
+def der_int(n):
+    return _der_tlv(0x02, n.to_bytes(n.bit_length() // 8 + 1, "big", signed=True))
 
-    conn = sqlite3.connect(str(db_path))
-    c = conn.cursor()
-    c.execute("CREATE TABLE metadata (id TEXT, item1 BLOB, item2 BLOB)")
-    c.execute("CREATE TABLE nssPrivate (a11 BLOB, a102 BLOB)")
 
-    global_salt = os.urandom(20)
-    master_password = "test-plaintext"
+def der_octet(b):
+    return _der_tlv(0x04, b)
 
-    entry_salt_check = os.urandom(20)
-    # Use PLAINTEXT here!
-    item2 = build_pbes2_sequence(
-        global_salt,
-        master_password,
-        entry_salt_check,
-        iters=1000,
-        plaintext=b"password-check",
-        hash_method="plaintext",
-    )
 
-    c.execute(
-        "INSERT INTO metadata (id, item1, item2) VALUES (?, ?, ?)",
-        ("password", global_salt, item2),
-    )
+def der_oid(oid):
+    body = bytearray([40 * oid[0] + oid[1]])
+    for arc in oid[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        body += bytes(reversed(chunk))
+    return _der_tlv(0x06, bytes(body))
 
-    real_master_key = b"B" * 32
-    entry_salt_key = os.urandom(20)
 
-    a11 = build_pbes2_sequence(
-        global_salt,
-        master_password,
-        entry_salt_key,
-        iters=1000,
-        plaintext=real_master_key,
-        hash_method="plaintext",
+def encode_pbes2(entry_salt, iters, key_len, iv, ciphertext):
+    """
+    DER-encodes the PBES2 structure directly; the shape is fixed, so no
+    generic ASN.1 library is needed.
+    """
+    # Key Derivation Func
+    kdf_params = der_seq(
+        der_octet(entry_salt),
+        der_int(iters),
+        der_int(key_len),
+        # PRF AlgorithmIdentifier: 1.2.840.113549.2.9 = hmacWithSHA256
+        # ffpass logic checks len(pbkdf2_params) > 3. So we must add it as 4th element.
+        der_seq(der_oid((1, 2, 840, 113_549, 2, 9))),
     )
-    a102 = b"\x00" * 16
+    kdf = der_seq(der_oid(OID_PBKDF2), kdf_params)
 
-    c.execute("INSERT INTO nssPrivate (a11, a102) VALUES (?, ?)", (a11, a102))
+    # Encryption Scheme
+    enc_scheme = der_seq(der_oid(OID_AES256_CBC), der_octet(iv))
 
-    conn.commit()
-    conn.close()
+    pbes2_seq = der_seq(kdf, enc_scheme)
+    alg_id = der_seq(der_oid(OID_PBES2), pbes2_seq)
+    return der_seq(alg_id, der_octet(ciphertext))
 
-    print(f"Database created at {db_path}")
 
-    print("Attempting to unlock (plaintext)...")
-    keys, returned_salt = ffpass.get_all_keys(tmp_path, master_password)
+def save_db(conn, db_path):
+    """
+    Copy an in-memory database to disk without per-statement journaling.
+    """
+    dst = sqlite3.connect(str(db_path))
+    dst.execute("PRAGMA journal_mode=OFF")
+    dst.execute("PRAGMA synchronous=OFF")
+    conn.backup(dst)
+    dst.close()
 
-    print(f"Unlocked! Found {len(keys)} keys.")
-    assert len(keys) == 1
-    assert keys[0] == real_master_key
-    assert returned_salt == global_salt
-    print("SUCCESS: Master key verified correctly with PLAINTEXT hashing.")
 
+# hash_method -> (master password, real master key) for each mock profile
+MOCK_PROFILES = {
+    "plaintext": ("test-plaintext", b"B" * 32),
+    "sha256": ("test-new-profile", b"A" * 32),
+}
 
-def test_sha256_decryption(tmp_path):
-    import logging
 
-    logging.basicConfig(level=logging.DEBUG)
-    print("Setting up test_sha256_decryption...")
+@pytest.fixture(params=sorted(MOCK_PROFILES))
+def mock_key_db(tmp_path, request):
+    """
+    Builds a key4.db whose entries are encrypted with the given hash_method.
+    Returns (profile dir, master password, real master key, global salt).
+    """
+    hash_method = request.param
+    print(f"Setting up {hash_method} key DB...")
     db_path = tmp_path / "key4.db"
 
-    conn = sqlite3.connect(str(db_path))
+    # Build in memory, then write the finished DB out in one backup pass
+    conn = sqlite3.connect(":memory:")
     c = conn.cursor()
+    # One explicit transaction for the whole scaffolding, committed before save_db()
+    c.execute("BEGIN")
     c.execute("CREATE TABLE metadata (id TEXT, item1 BLOB, item2 BLOB)")
     c.execute("CREATE TABLE nssPrivate (a11 BLOB, a102 BLOB)")
 
-    global_salt = os.urandom(20)
-    master_password = "test-new-profile"
+    global_salt = GLOBAL_SALT
+    master_password, real_master_key = MOCK_PROFILES[hash_method]
 
     # 1. Create 'password' metadata entry
     # item1 = global_salt
     # item2 = encrypted "password-check" (padded to "password-check\x02\x02")
-
-    entry_salt_check = os.urandom(20)
-    # Use SHA256 here!
     item2 = build_pbes2_sequence(
         global_salt,
         master_password,
-        entry_salt_check,
+        ENTRY_SALT,
         iters=1000,
         plaintext=b"password-check",
-        hash_method="sha256",
+        hash_method=hash_method,
     )
 
     c.execute(
@@ -184,18 +182,14 @@ def test_sha256_decryption(tmp_path):
     )
 
     # 2. Create a 'nssPrivate' master key entry
-    # The actual master key (random 32 bytes)
-    real_master_key = b"A" * 32
-    entry_salt_key = os.urandom(20)
-
     # Encrypt the master key using the same derived key logic
     a11 = build_pbes2_sequence(
         global_salt,
         master_password,
-        entry_salt_key,
+        ENTRY_SALT,
         iters=1000,
         plaintext=real_master_key,
-        hash_method="sha256",
+        hash_method=hash_method,
     )
     # a102 is just the ID/Name of the key (usually looks like magic bytes)
     a102 = b"\x00" * 16
@@ -203,16 +197,22 @@ def test_sha256_decryption(tmp_path):
     c.execute("INSERT INTO nssPrivate (a11, a102) VALUES (?, ?)", (a11, a102))
 
     conn.commit()
+    save_db(conn, db_path)
     conn.close()
 
     print(f"Database created at {db_path}")
+    return tmp_path, master_password, real_master_key, global_salt
+
+
+def test_decryption(mock_key_db):
+    profile_dir, master_password, real_master_key, global_salt = mock_key_db
 
     # Now run ffpass logic
     print("Attempting to unlock...")
-    keys, returned_salt = ffpass.get_all_keys(tmp_path, master_password)
+    keys, returned_salt = ffpass.get_all_keys(profile_dir, master_password)
 
     print(f"Unlocked! Found {len(keys)} keys.")
     assert len(keys) == 1
     assert keys[0] == real_master_key
     assert returned_salt == global_salt
-    print("SUCCESS: Master key verified correctly with SHA256 hashing.")
+    print("SUCCESS: Master key verified correctly.")
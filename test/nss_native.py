@@ -1,46 +1,47 @@
 """Native bindings for NSS (Network Security Services) for testing credentials."""
 
-import base64
-import ctypes
 import json
 import os
-from ctypes import (
-    POINTER,
-    Structure,
-    byref,
-    c_char_p,
-    c_int,
-    c_ubyte,
-    c_uint,
-    c_void_p,
-    cast,
-)
+from itertools import islice
 from pathlib import Path
 
+from ._nss_cffi import ffi
 
-# --- NSS Structures ---
-class SECItem(Structure):
-    """Represents a SECItem structure in NSS."""
+try:
+    import pybase64 as base64
+except ImportError:  # Optional: SIMD base64 decoding of the SDR blobs
+    import base64  # type: ignore[no-redef]
 
-    # pylint: disable=too-few-public-methods
+try:
+    import ijson
+except ImportError:  # Optional: stream logins.json instead of loading it whole
+    ijson = None
 
-    _fields_ = [
-        ("type", c_uint),
-        ("data", POINTER(c_ubyte)),
-        ("len", c_uint),
-    ]
+try:
+    import orjson
+except ImportError:  # Optional: faster whole-file parse when ijson is missing
+    orjson = None
 
-    def __init__(self):
-        """Initialize with default values."""
-        super().__init__()
-        self.type = 0
-        self.data = None
-        self.len = 0
+# Logins decrypted per shared decode buffer; bounds memory when streaming
+LOGIN_BATCH_SIZE = 256
+
+# Errors that abort the decryption loop (ijson raises its own, not ValueError)
+_LOOP_ERRORS = (RuntimeError, OSError, TypeError, ValueError) + (
+    (ijson.JSONError,) if ijson is not None else ()
+)
 
 
 # --- Load Library ---
+# Loaded once; the prototypes come from the cdef in _nss_cffi.
+_NSS_LIB = None
+
+
 def load_nss():
     """Attempt to load the libnss3 shared library."""
+    global _NSS_LIB  # pylint: disable=global-statement
+    if _NSS_LIB is not None:
+        return _NSS_LIB
+
     paths = [
         "/usr/lib/x86_64-linux-gnu/libnss3.so",
         "/usr/lib/libnss3.so",
@@ -50,45 +51,79 @@ def load_nss():
     lib = None
     for p in paths:
         try:
-            lib = ctypes.CDLL(p)
+            # Resolve everything now and keep it mapped across NSS_Shutdown()
+            lib = ffi.dlopen(p, os.RTLD_NOW | os.RTLD_NODELETE)
             break
         except OSError:
             pass
+    _NSS_LIB = lib
     return lib
 
 
+def decrypt_sdr_bytes(lib, b64_data):
+    """Decrypt base64 data using PK11SDR_Decrypt, returning the raw plaintext."""
+    arena, spans = _decode_blobs([b64_data])
+    return _decrypt_span(lib, ffi.from_buffer("unsigned char[]", arena), spans[0])
+
+
 def decrypt_sdr(lib, b64_data):
     """Decrypt base64 data using PK11SDR_Decrypt."""
-    if not b64_data:
+    content = decrypt_sdr_bytes(lib, b64_data)
+    if content is None:
         return None
+    return content.decode("utf-8", errors="replace")
 
-    try:
-        raw_data = base64.b64decode(b64_data)
-    except (TypeError, ValueError):
-        return None
 
-    # Prepare SECItem input
-    item_in = SECItem()
+def _decode_blobs(blobs):
+    """
+    Base64-decode every blob into one shared buffer.
+    Returns (arena, spans) where each span is (offset, length) or None.
+    The blobs are decoded one by one: the decoder stops at the first '='
+    padding, so a joined string would lose everything after a padded blob.
+    """
+    arena = bytearray()
+    spans = []
+    for b64_data in blobs:
+        # SDR blobs are always padded, so a ragged length is rejected up front
+        if not isinstance(b64_data, (str, bytes)) or not b64_data or len(b64_data) & 3:
+            spans.append(None)
+            continue
+        try:
+            raw_data = base64.b64decode(b64_data)
+        except (TypeError, ValueError):
+            spans.append(None)
+            continue
+        spans.append((len(arena), len(raw_data)))
+        arena += raw_data
+    return arena, spans
+
+
+def _new_items():
+    """Allocate an (input, output) SECItem pair for _decrypt_span to reuse."""
+    item_in = ffi.new("SECItem *")
     item_in.type = 0  # SECItemTypeBuffer
-    item_in.len = len(raw_data)
+    return item_in, ffi.new("SECItem *")
 
-    # Create byte buffer matching length
-    buf = (c_ubyte * len(raw_data)).from_buffer_copy(raw_data)
-    item_in.data = cast(buf, POINTER(c_ubyte))
 
-    # Output item
-    item_out = SECItem()
+def _decrypt_span(lib, data, span, items=None):
+    """Decrypt one decoded blob in place, returning the plaintext bytes or None."""
+    if not span:
+        return None
+    offset, length = span
+    item_in, item_out = items or _new_items()
+
+    # Point the input item into the arena
+    item_in.data = data + offset
+    item_in.len = length
 
-    ret = lib.PK11SDR_Decrypt(byref(item_in), byref(item_out), None)
+    ret = lib.PK11SDR_Decrypt(item_in, item_out, ffi.NULL)
 
     if ret == 0:
         # Success
-        content = ctypes.string_at(item_out.data, item_out.len)
-        # Free memory allocated by NSS
-        lib.SECITEM_FreeItem(
-            byref(item_out), 0
-        )  # 0 = freeItem (don't free structure itself if not allocated)
-        return content.decode("utf-8", errors="replace")
+        content = ffi.buffer(item_out.data, item_out.len)[:]
+        # Free memory allocated by NSS; freeit=0 keeps item_out for the next call
+        lib.SECITEM_FreeItem(item_out, 0)
+        return content
 
     return None
 
@@ -112,29 +147,13 @@ def get_native_logins(directory: Path, password: str) -> list:
         print("WARNING: Could not load libnss3.so. Native validation skipped.")
         return []
 
-    # Function Signatures
-    lib.NSS_Init.argtypes = [c_char_p]
-    lib.NSS_Init.restype = c_int
-
-    lib.PK11_GetInternalKeySlot.restype = c_void_p
-
-    lib.PK11_CheckUserPassword.argtypes = [c_void_p, c_char_p]
-    lib.PK11_CheckUserPassword.restype = c_int
-
-    lib.NSS_Shutdown.restype = c_int
-
-    lib.PK11SDR_Decrypt.argtypes = [POINTER(SECItem), POINTER(SECItem), c_void_p]
-    lib.PK11SDR_Decrypt.restype = c_int
-
-    lib.SECITEM_FreeItem.argtypes = [POINTER(SECItem), c_int]
-    lib.SECITEM_FreeItem.restype = None
-
     # Initialize NSS
     db_dir = os.path.abspath(profile_path)
-    if db_dir.endswith("/key4.db") or db_dir.endswith("/logins.json"):
+    if os.path.basename(db_dir) in ("key4.db", "logins.json"):
         db_dir = os.path.dirname(db_dir)
 
-    config_dir = f"sql:{db_dir}".encode("utf-8")
+    # Paths go to NSS in the filesystem encoding, not re-encoded as UTF-8
+    config_dir = b"sql:" + os.fsencode(db_dir)
 
     # We must try to init. If already inited by process?
     # Python process usually distinct.
@@ -156,42 +175,70 @@ def get_native_logins(directory: Path, password: str) -> list:
 
         # Read logins.json
         logins_path = os.path.join(db_dir, "logins.json")
-        if not os.path.exists(logins_path):
+        try:
+            # Open directly rather than checking existence first
+            with open(logins_path, "rb") as logins_file:
+                return _decrypt_logins(lib, logins_file)
+        except FileNotFoundError:
             return []  # No file, empty list
 
-        with open(logins_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if "logins" not in data:
-            return []
-
-        results = _parse_logins_data(lib, data["logins"])
-        return results
-
-    except (RuntimeError, OSError, TypeError, ValueError) as e:
+    except _LOOP_ERRORS as e:
         print(f"Native decryption loop failed: {e}")
         return []
     finally:
         lib.NSS_Shutdown()
 
 
+def _decrypt_logins(lib, logins_file):
+    """Decrypt logins.json batch by batch."""
+    results = []
+    logins = _iter_logins(logins_file)
+    while True:
+        batch = list(islice(logins, LOGIN_BATCH_SIZE))
+        if not batch:
+            return results
+        results.extend(_parse_logins_data(lib, batch))
+
+
+def _iter_logins(f):
+    """Yield the entries of logins.json, one at a time with ijson if available."""
+    if ijson is not None:
+        yield from ijson.items(f, "logins.item")
+        return
+    # Parse the raw bytes directly; no text-mode decode pass first
+    if orjson is not None:
+        data = orjson.loads(f.read())  # pylint: disable=no-member
+    else:
+        data = json.load(f)
+    yield from data.get("logins", [])
+
+
+def _login_text(content):
+    """Decode a decrypted login field for the results dict."""
+    if content is None:
+        return "(error)"
+    return content.decode("utf-8", errors="replace")
+
+
 def _parse_logins_data(lib, logins_list):
     """Decrypt the list of login entries."""
-    results = []
+    # Collect each distinct username/password blob once; identical blobs
+    # (e.g. one account shared across subdomains) decode and decrypt once.
+    blob_index = {}
+    refs = []
     for login in logins_list:
-        hostname = login.get("hostname", "")
-        enc_user = login.get("encryptedUsername")
-        enc_pass = login.get("encryptedPassword")
-
-        dec_user = decrypt_sdr(lib, enc_user)
-        dec_pass = decrypt_sdr(lib, enc_pass)
-
-        if dec_user is None:
-            dec_user = "(error)"
-        if dec_pass is None:
-            dec_pass = "(error)"
-
-        results.append(
-            {"hostname": hostname, "username": dec_user, "password": dec_pass}
-        )
-    return results
+        for field in ("encryptedUsername", "encryptedPassword"):
+            refs.append(blob_index.setdefault(login.get(field), len(blob_index)))
+    arena, spans = _decode_blobs(list(blob_index))
+    data = ffi.from_buffer("unsigned char[]", arena)
+    items = _new_items()
+    texts = [_login_text(_decrypt_span(lib, data, span, items)) for span in spans]
+
+    return [
+        {
+            "hostname": login.get("hostname", ""),
+            "username": texts[refs[2 * i]],
+            "password": texts[refs[2 * i + 1]],
+        }
+        for i, login in enumerate(logins_list)
+    ]
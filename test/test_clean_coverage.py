@@ -3,9 +3,16 @@
 import io
 import sqlite3
 import sys
+from types import SimpleNamespace
 from unittest import mock
 
-from git_sqlite_filter.clean import collation_func, format_sql_value, main, maybe_warn
+from git_sqlite_filter.clean import (
+    DatabaseDumper,
+    collation_func,
+    format_sql_value,
+    main,
+    maybe_warn,
+)
 
 
 def test_format_sql_value_variants():
@@ -25,6 +32,48 @@ def test_collation_func():
     assert collation_func("a", "b") == -1
 
 
+def _dump_collated_rows(db_path, rows, encoding="UTF-8"):
+    """Dump a no-PK table with a custom-collated column; return the VALUES parts."""
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA encoding = '{encoding}'")
+    conn.create_collation("MYCOLL", collation_func)
+    conn.execute("CREATE TABLE t (c TEXT COLLATE MYCOLL, n TEXT COLLATE NOCASE)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    args = SimpleNamespace(
+        float_precision=None, schema_only=False, data_only=True, debug=False
+    )
+    out = io.StringIO()
+    with DatabaseDumper(str(db_path), args) as dumper:
+        assert dumper.dump(out)
+    return [
+        line.split("VALUES ")[1]
+        for line in out.getvalue().splitlines()
+        if "INSERT" in line
+    ]
+
+
+def test_custom_collation_sorts_as_binary(tmp_path):
+    """Custom-collated columns sort as BINARY in a full sort; NOCASE ones don't."""
+    rows = [("b", "y"), ("B", "x"), ("A", "z")]
+    assert _dump_collated_rows(tmp_path / "collate.db", rows) == [
+        "('A', 'z');",
+        "('B', 'x');",
+        "('b', 'y');",
+    ]
+
+
+def test_custom_collation_utf16_keeps_code_point_order(tmp_path):
+    """UTF-16 BINARY puts surrogate pairs before U+FFFD; collation_func doesn't."""
+    rows = [("\U0001f600", "x"), ("\ufffd", "y")]
+    assert _dump_collated_rows(tmp_path / "utf16.db", rows, "UTF-16le") == [
+        "('\ufffd', 'y');",
+        "('\U0001f600', 'x');",
+    ]
+
+
 def test_wal_mode_integration(tmp_path, monkeypatch, capsys):
     """Firefox-style WAL DB should work without errors."""
     db_path = tmp_path / "wal.db"
@@ -50,15 +99,15 @@ def test_wal_mode_integration(tmp_path, monkeypatch, capsys):
 def test_maybe_warn():
     """Test the warning debounce logic."""
     with mock.patch("time.time") as mock_time, mock.patch(
-        "os.path.exists"
-    ) as mock_exists, mock.patch("os.path.getmtime") as mock_getmtime, mock.patch(
+        "os.stat"
+    ) as mock_stat, mock.patch(
         "builtins.open", mock.mock_open()
     ) as mock_file, mock.patch(
         "sys.stderr.write"
     ) as mock_log:
 
         # Case 1: First run (no sentinel)
-        mock_exists.return_value = False
+        mock_stat.side_effect = FileNotFoundError
         mock_time.return_value = 1000.0
 
         maybe_warn()
@@ -73,8 +122,8 @@ def test_maybe_warn():
         mock_file.reset_mock()
 
         # Case 2: Run immediately after (debounce)
-        mock_exists.return_value = True
-        mock_getmtime.return_value = 1000.0
+        mock_stat.side_effect = None
+        mock_stat.return_value = SimpleNamespace(st_mtime=1000.0)
         mock_time.return_value = 1002.0  # 2 seconds later
 
         maybe_warn()
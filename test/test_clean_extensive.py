@@ -6,6 +6,9 @@ import sqlite3
 import subprocess
 from unittest import mock
 
+import pytest
+
+from git_sqlite_filter import utils
 from git_sqlite_filter.clean import main as clean_main
 
 
@@ -50,8 +53,13 @@ def test_debug_mode_and_without_rowid(tmp_path):
     assert 'INSERT INTO "standard"' in sql
 
 
-def test_submodule_skip_logic(tmp_path):
+@pytest.mark.parametrize("use_pygit2", [True, False], ids=["pygit2", "subprocess"])
+def test_submodule_skip_logic(tmp_path, monkeypatch, use_pygit2):
     """Test submodule skip configuration checks using real git commands."""
+    if not use_pygit2:
+        monkeypatch.setattr(utils, "load_pygit2", lambda: None)
+    elif utils.load_pygit2() is None:
+        pytest.skip("pygit2 not installed")
 
     # Setup: Create a superproject and a submodule
     super_dir = tmp_path / "super"
@@ -0,0 +1,84 @@
+"""Tests for the long-running filter.process protocol."""
+
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+
+from git_sqlite_filter.process import (
+    read_content,
+    read_text_list,
+    write_content,
+    write_text_list,
+)
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+
+def run_requests(requests, cwd):
+    """Run a filter process over (command, pathname, content) requests."""
+    req = io.BytesIO()
+    write_text_list(req, ["git-filter-client", "version=2"])
+    write_text_list(req, ["capability=clean", "capability=smudge", "capability=delay"])
+    for command, pathname, content in requests:
+        write_text_list(req, [f"command={command}", f"pathname={pathname}"])
+        write_content(req, io.BytesIO(content))
+
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(SRC_DIR))
+    env.pop("GIT_DIR", None)
+    proc = subprocess.run(
+        [sys.executable, "-m", "git_sqlite_filter.process", "--process"],
+        input=req.getvalue(),
+        capture_output=True,
+        cwd=cwd,
+        env=env,
+        check=True,
+    )
+
+    resp = io.BytesIO(proc.stdout)
+    assert read_text_list(resp) == ["git-filter-server", "version=2"]
+    assert read_text_list(resp) == ["capability=clean", "capability=smudge"]
+
+    results = []
+    for _ in requests:
+        status = read_text_list(resp)
+        if status == ["status=success"]:
+            content = io.BytesIO()
+            read_content(resp, content)
+            results.append(content.getvalue())
+            assert not read_text_list(resp)
+        else:
+            results.append(None)
+    assert resp.read() == b""
+    return results
+
+
+def test_process_round_trip(tmp_path):
+    """Clean then smudge through one process and compare the database."""
+    db_path = tmp_path / "data.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?, ?)", [(1, "a"), (2, "b")])
+    conn.close()
+
+    sql = run_requests([("clean", "data.db", db_path.read_bytes())], tmp_path)[0]
+    assert b'INSERT INTO "t"' in sql
+
+    # Second request in the same process, plus a bad one that must not kill it
+    results = run_requests(
+        [("smudge", "data.db", sql), ("smudge", "bad.db", b"NOT SQL;\n")],
+        tmp_path,
+    )
+    binary, bad = results[0], results[1]
+    assert binary.startswith(b"SQLite format 3\x00")
+    assert bad is None
+
+    restored = tmp_path / "restored.db"
+    restored.write_bytes(binary)
+    with sqlite3.connect(restored) as conn:
+        assert conn.execute("SELECT * FROM t ORDER BY id").fetchall() == [
+            (1, "a"),
+            (2, "b"),
+        ]
+    conn.close()
@@ -2,11 +2,17 @@
 
 import os
 import sqlite3
+import tempfile
 import unittest
 from io import StringIO
 from unittest.mock import patch
 
-from git_sqlite_filter.smudge import DatabaseRestorer
+from git_sqlite_filter.smudge import (
+    DatabaseRestorer,
+    filter_sql_stream,
+    iter_statements,
+)
+from git_sqlite_filter.utils import SHM_DIR, get_scratch_dir
 
 
 class TestSmudgeResilience(unittest.TestCase):
@@ -28,7 +34,7 @@ class TestSmudgeResilience(unittest.TestCase):
         ]
 
         with patch("sys.stderr", new_callable=StringIO) as mock_stderr:
-            restorer = DatabaseRestorer(debug=True)
+            restorer = DatabaseRestorer(debug=True, target=":memory:")
             # Should return True (success) despite the error
             success = restorer.restore(sql_script)
 
@@ -36,19 +42,14 @@ class TestSmudgeResilience(unittest.TestCase):
                 success, "Restore should succeed even with missing table errors"
             )
 
-            # Verify the database state
+            # Verify the database state on the still-open in-memory connection
             self.assertIsNotNone(restorer.conn)
-            # The original connection is closed, but the file exists at restorer.tmp_path
-            self.assertTrue(os.path.exists(restorer.tmp_path))
+            self.assertIsNone(restorer.tmp_path)
 
-            with sqlite3.connect(restorer.tmp_path) as check_conn:
-                cursor = check_conn.cursor()
-
-                # Valid data should exist
-                cursor.execute("SELECT * FROM valid_table")
-                rows = cursor.fetchall()
-                self.assertEqual(len(rows), 1)
-                self.assertEqual(rows[0], (1, "foo"))
+            # Valid data should exist
+            rows = restorer.conn.execute("SELECT * FROM valid_table").fetchall()
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(rows[0], (1, "foo"))
 
             # Verify warning was logged
             log_output = mock_stderr.getvalue()
@@ -56,6 +57,135 @@ class TestSmudgeResilience(unittest.TestCase):
             self.assertIn("warning: ignoring error: no such table:", log_output)
             self.assertIn("missing_table", log_output)
 
+    def test_restore_from_generator(self):
+        """
+        Verify that restore() streams a generator without materializing it.
+        """
+
+        def statements():
+            yield "PRAGMA foreign_keys=OFF;\n"
+            yield "BEGIN TRANSACTION;\n"
+            yield "CREATE TABLE t (id INTEGER PRIMARY KEY);\n"
+            for i in range(1000):
+                yield f"INSERT INTO t VALUES ({i});\n"
+            yield "COMMIT;\n"
+
+        with DatabaseRestorer(fast=True) as restorer:
+            self.assertTrue(restorer.restore(statements()))
+            with sqlite3.connect(restorer.tmp_path) as check_conn:
+                count = check_conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+            self.assertEqual(count, 1000)
+
+    def test_dot_commands_never_reach_sqlite3_binary(self):
+        """
+        Verify a dot-command in the dump is rejected, not run by the sqlite3 shell.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker = os.path.join(tmp_dir, "pwned")
+            sql_script = [
+                "CREATE TABLE t (x);\n",
+                f".shell touch {marker}\nINSERT INTO t VALUES (1);\n",
+            ]
+            with DatabaseRestorer() as restorer, patch(
+                "sys.stderr", new_callable=StringIO
+            ):
+                self.assertFalse(restorer.restore(sql_script))
+            self.assertFalse(os.path.exists(marker))
+
+    def test_full_scratch_dir_retries_in_temp_dir(self):
+        """
+        Verify a restore that fills the RAM-backed scratch dir is retried on disk.
+        """
+        connect = sqlite3.connect
+
+        def connect_tiny_scratch(path, *args, **kwargs):
+            conn = connect(path, *args, **kwargs)
+            if str(path).startswith(scratch_dir):
+                # Simulate a 64 MiB Docker /dev/shm running out of room
+                conn.execute("PRAGMA max_page_count=1")
+            return conn
+
+        sql_script = [
+            "BEGIN TRANSACTION;\n",
+            "CREATE TABLE t (id INTEGER PRIMARY KEY);\n",
+            "INSERT INTO t VALUES (1);\n",
+            "COMMIT;\n",
+        ]
+        with tempfile.TemporaryDirectory() as scratch_dir, patch(
+            "shutil.which", return_value=None
+        ), patch("sqlite3.connect", connect_tiny_scratch), patch(
+            "sys.stderr", new_callable=StringIO
+        ), DatabaseRestorer() as restorer:
+            restorer.scratch_dir = scratch_dir
+            self.assertTrue(restorer.restore(sql_script))
+            self.assertIsNone(restorer.scratch_dir)
+            with connect(restorer.tmp_path) as check_conn:
+                rows = check_conn.execute("SELECT id FROM t").fetchall()
+            self.assertEqual(rows, [(1,)])
+
+    def test_small_shm_is_not_used_for_scratch(self):
+        """
+        Verify get_scratch_dir skips a tmpfs with less free space than required.
+        """
+        tiny = os.statvfs_result((4096, 4096, 16384, 1, 1, 0, 0, 0, 0, 255))
+        with patch("os.path.isdir", return_value=True), patch(
+            "os.access", return_value=True
+        ), patch("os.statvfs", return_value=tiny, create=True):
+            self.assertIsNone(get_scratch_dir(min_free=8192))
+            self.assertEqual(get_scratch_dir(min_free=4096), SHM_DIR)
+
+    def test_iter_statements_multiline(self):
+        """
+        Verify statement splitting across lines, including ';' inside strings.
+        """
+        lines = [
+            "CREATE TABLE t (a TEXT);\n",
+            "INSERT INTO t VALUES ('one;\n",
+            "two\n",
+            "three;');\n",
+            "INSERT INTO t VALUES ('x');\n",
+        ]
+        self.assertEqual(
+            list(iter_statements(lines)),
+            [
+                "CREATE TABLE t (a TEXT);\n",
+                "INSERT INTO t VALUES ('one;\ntwo\nthree;');\n",
+                "INSERT INTO t VALUES ('x');\n",
+            ],
+        )
+
+    def test_fts_shadow_triggers(self):
+        """
+        Verify only triggers on real FTS shadow tables are dropped, not look-alikes.
+        """
+        dump = [
+            'CREATE VIRTUAL TABLE "docs" USING fts5(body);\n',
+            "CREATE TABLE order_content (id INTEGER PRIMARY KEY);\n",
+            "CREATE TRIGGER t1 AFTER INSERT ON docs_content BEGIN SELECT 1; END;\n",
+            "CREATE TRIGGER t2 AFTER INSERT ON order_content BEGIN SELECT 1; END;\n",
+        ]
+        out = "".join(filter_sql_stream(dump))
+        self.assertNotIn("t1", out)
+        self.assertIn("t2", out)
+
+    def test_fts_shadow_triggers_across_streams(self):
+        """
+        Verify shadow triggers are dropped when the vtab comes from a schema stream,
+        including schema-qualified trigger targets.
+        """
+        fts_shadows = set()
+        schema = ['CREATE VIRTUAL TABLE "docs" USING fts5(body);\n']
+        data = [
+            "CREATE TRIGGER t1 INSERT ON main.docs_content BEGIN SELECT 1; END;\n",
+            'CREATE TRIGGER t2 INSERT ON "main"."docs_idx" BEGIN SELECT 1; END;\n',
+            "CREATE TRIGGER t3 INSERT ON main.other BEGIN SELECT 1; END;\n",
+        ]
+        list(filter_sql_stream(schema, fts_shadows=fts_shadows))
+        out = "".join(filter_sql_stream(data, fts_shadows=fts_shadows))
+        self.assertNotIn("t1", out)
+        self.assertNotIn("t2", out)
+        self.assertIn("t3", out)
+
     def test_collation_retry_limit(self):
         """
         Verify that we can handle a reasonable number of missing collations.
@@ -63,21 +193,22 @@ class TestSmudgeResilience(unittest.TestCase):
         Answer: Each pass only discovers ONE missing collation.
         If a DB uses 10 different custom collations, we need 10 retries.
         """
-        # Create a script generating many collation errors
-        # We'll use a custom collation function for the test
-
         # This script needs N passes to discover N collations
         collations = [f"COLL_{i}" for i in range(5)]
-        sql_script = ["PRAGMA foreign_keys=OFF;\n", "BEGIN TRANSACTION;\n"]
-        for col in collations:
-            sql_script.append(f"CREATE TABLE t_{col} (x TEXT COLLATE {col});\n")
-            sql_script.append(
+        sql_script = [
+            "PRAGMA foreign_keys=OFF;\n",
+            "BEGIN TRANSACTION;\n",
+            *(
+                # The ORDER BY triggers collation usage
+                f"CREATE TABLE t_{col} (x TEXT COLLATE {col});\n"
                 f"SELECT * FROM t_{col} ORDER BY x;\n"
-            )  # Trigger collation usage
-        sql_script.append("COMMIT;\n")
+                for col in collations
+            ),
+            "COMMIT;\n",
+        ]
 
         with patch("sys.stderr", new_callable=StringIO) as _:
-            restorer = DatabaseRestorer(debug=True)
+            restorer = DatabaseRestorer(debug=True, target=":memory:")
             success = restorer.restore(sql_script)
 
             self.assertTrue(success)
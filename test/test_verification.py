@@ -1,94 +1,131 @@
 """Verification tests running against real binaries or modules."""
 
 import glob
+import hashlib
 import os
 import re
 import shutil
 import subprocess
 import sys
 import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import pytest
 
-# Constants
-TEST_DIR = "test/fixtures"
+from git_sqlite_filter.clean import main as clean_main
+from git_sqlite_filter.smudge import main as smudge_main
+
+from .filter_main import invoke_main
+from .fixture_paths import FIXTURE_DIR
+
+# Every .db under the fixtures, Firefox profiles included. Sorted, since glob
+# returns filesystem order and test IDs must be stable for --lf and xdist.
+ROUND_TRIP_DBS = tuple(
+    sorted(glob.glob(os.path.join(FIXTURE_DIR, "**", "*.db"), recursive=True))
+)
+# INSERTs into FTS shadow tables; anchored so match() fails fast on other lines
+_FTS_SHADOW_RE = re.compile(
+    r'INSERT INTO "?[^\s"]*_(data|idx|content|docsize|config)"?'
+)
 
 
 def run_clean(db_path):
-    """Run the clean filter on a database file."""
+    """Run the clean filter on a database file (in-process)."""
+    returncode, out, err = invoke_main(clean_main, ["git-sqlite-clean", str(db_path)])
+    if returncode != 0:
+        return None, err
+    return out.decode("utf-8"), None
+
+
+def run_smudge(sql_input):
+    """Run the smudge filter on SQL input (in-process)."""
+    # Encode input to bytes as smudge expects binary input stream
+    if isinstance(sql_input, str):
+        sql_input = sql_input.encode("utf-8")
+
+    returncode, out, err = invoke_main(smudge_main, ["git-sqlite-smudge"], sql_input)
+    if returncode != 0:
+        print(f"Smudge error: {err}")
+        return None, err
+    return out, None
+
+
+def run_module(module, args, input_bytes=None):
+    """Run a filter as `python -m` against the current src/ tree."""
     # Always use the module to test the current code, not installed binary
-    cmd = [sys.executable, "-m", "git_sqlite_filter.clean", str(db_path)]
+    cmd = [sys.executable, "-m", module, *args]
     env = os.environ.copy()
 
     # Critical: Ensure src/ is in PYTHONPATH
     src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
     env["PYTHONPATH"] = f"{src_path}{os.pathsep}{env.get('PYTHONPATH', '')}"
 
-    # Run git-sqlite-clean
-    result = subprocess.run(cmd, capture_output=True, text=True, env=env, check=False)
-    if result.returncode != 0:
-        return None, result.stderr
-    return result.stdout, None
+    return subprocess.run(
+        cmd, input=input_bytes, capture_output=True, env=env, check=False
+    )
 
 
-def run_smudge(sql_input):
-    """Run the smudge filter on SQL input."""
-    # Always use the module to test the current code, not installed binary
-    cmd = [sys.executable, "-m", "git_sqlite_filter.smudge"]
-    env = os.environ.copy()
-    src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
-    env["PYTHONPATH"] = f"{src_path}{os.pathsep}{env.get('PYTHONPATH', '')}"
+@lru_cache(maxsize=None)
+def _sqlite3_bin():
+    """Resolve the sqlite3 binary once per session (PATH does not change)."""
+    return shutil.which("sqlite3")
 
-    # Encode input to bytes as smudge expects binary input stream
-    if isinstance(sql_input, str):
-        sql_input = sql_input.encode("utf-8")
 
+@lru_cache(maxsize=None)
+def _sqlite3_version():
+    """The sqlite3 binary's version line, so an upgrade invalidates cached dumps."""
     result = subprocess.run(
-        cmd,
-        input=sql_input,
+        [_sqlite3_bin() or "sqlite3", "--version"],
         capture_output=True,
-        text=None,  # Capture binary output
-        env=env,
+        text=True,
         check=False,
     )
-    if result.returncode != 0:
-        print(f"Smudge error: {result.stderr.decode('utf-8', errors='replace')}")
-        return None, result.stderr.decode("utf-8", errors="replace")
-    return result.stdout, None
+    return result.stdout.strip()
 
 
-def run_sqlite_dump(db_path):
-    """Run sqlite3 .dump on the database file."""
-    cmd = ["sqlite3", db_path, ".dump"]
+def run_sqlite_dump(db_path, cache=None):
+    """
+    Run sqlite3 .dump on the database file.
+    With a pytest cache, the dump is reused until the file's mtime/size or the
+    sqlite3 version change.
+    """
+    key = None
+    if cache is not None:
+        st = os.stat(db_path)
+        ident = (
+            f"{os.path.abspath(db_path)}:{st.st_mtime_ns}:{st.st_size}:"
+            f"{_sqlite3_version()}"
+        )
+        key = f"git-sqlite-filter/dump/{hashlib.sha1(ident.encode()).hexdigest()}"
+        cached = cache.get(key, None)
+        if cached is not None:
+            return cached, None
+
+    cmd = [_sqlite3_bin() or "sqlite3", db_path, ".dump"]
     result = subprocess.run(cmd, capture_output=True, text=True, check=False)
     if result.returncode != 0:
         return None, result.stderr
+    if key is not None:
+        cache.set(key, result.stdout)
     return result.stdout, None
 
 
 def normalize(sql):
-    """Normalize SQL for rough comparison (ignoring comments/whitespace/sorting)."""
+    """
+    Normalize SQL for rough comparison (ignoring comments/whitespace/order).
+    Returns a Counter of lines, so comparison is a multiset check without sorting.
+    """
     if not sql:
-        return []
-    lines = [
-        line.strip()
-        for line in sql.splitlines()
-        if line.strip() and not line.startswith("--")
-    ]
+        return Counter()
+    lines = (line.strip() for line in sql.splitlines() if not line.startswith("--"))
     # Filter out FTS shadow tables (internal representation matches are not guaranteed)
-    lines = [
-        line
-        for line in lines
-        if not re.search(r'INSERT INTO "?.*_(data|idx|content|docsize|config)"?', line)
-    ]
-    lines.sort()
-    return lines
+    return Counter(line for line in lines if line and not _FTS_SHADOW_RE.match(line))
 
 
-@pytest.mark.parametrize(
-    "db_file", glob.glob(os.path.join(TEST_DIR, "**", "*.db"), recursive=True)
-)
-def test_full_round_trip(db_file):
+@pytest.mark.parametrize("db_file", ROUND_TRIP_DBS)
+def test_full_round_trip(db_file, pytestconfig):
     """
     Verify correctness by full round-trip:
     Original DB -> clean -> SQL -> smudge -> New DB
@@ -96,7 +133,7 @@ def test_full_round_trip(db_file):
     Original DB .dump == New DB .dump
     """
 
-    if shutil.which("sqlite3") is None:
+    if _sqlite3_bin() is None:
         pytest.skip("sqlite3 binary not found in PATH")
 
     print(f"Verifying {db_file}...")
@@ -110,40 +147,59 @@ def test_full_round_trip(db_file):
     smudge_out_bytes, smudge_err = run_smudge(clean_out)
     assert smudge_out_bytes is not None, f"Smudge failed: {smudge_err}"
 
+    # A byte-identical rebuild is trivially equal; skip both .dump runs
+    if os.path.getsize(db_file) == len(smudge_out_bytes):
+        with open(db_file, "rb") as f:
+            if f.read() == smudge_out_bytes:
+                return
+
     with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as tmp_db:
         tmp_db.write(smudge_out_bytes)
         tmp_db_path = tmp_db.name
 
     try:
-        _verify_round_trip_equality(db_file, tmp_db_path)
+        _verify_round_trip_equality(
+            db_file, tmp_db_path, getattr(pytestconfig, "cache", None)
+        )
     finally:
         if os.path.exists(tmp_db_path):
             os.remove(tmp_db_path)
 
 
-def _verify_round_trip_equality(original_db, restored_db):
+def _verify_round_trip_equality(original_db, restored_db, cache=None):
     """Helpers to dump and compare two databases."""
-    # 3. Dump both
-    dump_orig, err_orig = run_sqlite_dump(original_db)
+    # 3. Dump both concurrently; the work happens in the sqlite3 processes.
+    # (The original's dump only changes with the fixture file, so it is cached.)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        fut_orig = executor.submit(run_sqlite_dump, original_db, cache)
+        fut_new = executor.submit(run_sqlite_dump, restored_db)
+        dump_orig, err_orig = fut_orig.result()
+        dump_new, err_new = fut_new.result()
     assert dump_orig is not None, f"Dump original failed: {err_orig}"
-
-    dump_new, err_new = run_sqlite_dump(restored_db)
     assert dump_new is not None, f"Dump restored failed: {err_new}"
 
     # 4. Compare
     lines_orig = normalize(dump_orig)
     lines_new = normalize(dump_new)
 
-    diff_count = abs(len(lines_orig) - len(lines_new))
+    if lines_orig == lines_new:
+        return
+
+    only_orig = lines_orig - lines_new
+    only_new = lines_new - lines_orig
+    print(f"\nUnique to original: {only_orig.most_common(5)}")
+    print(f"Unique to restored: {only_new.most_common(5)}")
+    diff_count = sum(only_orig.values()) + sum(only_new.values())
+    pytest.fail(f"Round-trip content mismatch! Diff count: {diff_count}")
+
 
-    if diff_count > 0:
-        set_orig = set(lines_orig)
-        set_new = set(lines_new)
-        unique_orig = list(set_orig - set_new)[:5]
-        unique_new = list(set_new - set_orig)[:5]
-        print(f"\nUnique to original: {unique_orig}")
-        print(f"Unique to restored: {unique_new}")
+def test_cli_subprocess_smoke():
+    """One real clean | smudge pipeline through fresh interpreters."""
+    db_file = os.path.join(FIXTURE_DIR, "version_0.db")
+    clean = run_module("git_sqlite_filter.clean", [db_file])
+    assert clean.returncode == 0, clean.stderr.decode("utf-8", errors="replace")
+    assert b"CREATE TABLE" in clean.stdout
 
-    assert (
-        lines_orig == lines_new
-    ), f"Round-trip content mismatch! Diff count: {diff_count}"
+    smudge = run_module("git_sqlite_filter.smudge", [], clean.stdout)
+    assert smudge.returncode == 0, smudge.stderr.decode("utf-8", errors="replace")
+    assert smudge.stdout.startswith(b"SQLite format 3")
@@ -1,25 +1,52 @@
 """Script to verify handling of Firefox-like profiles with WAL/Foreign Keys."""
 
+import contextlib
+import hashlib
+import inspect
 import os
+import shutil
 import sqlite3
 import subprocess
 import sys
 import tempfile
-
-
-def create_firefox_style_db(path):
+from collections import namedtuple
+from functools import lru_cache
+
+# Fallback when git-sqlite-clean is not installed: run the module from src/.
+# (Running clean.py as a script breaks its package-relative imports.)
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+# -s skips the user site dir; site-packages stays for the optional pygit2
+CLEAN_FALLBACK_CMD = (sys.executable, "-s", "-m", "git_sqlite_filter.clean")
+CLEAN_FALLBACK_ENV = {
+    **os.environ,
+    "PYTHONPATH": os.pathsep.join(
+        filter(None, (SRC_DIR, os.environ.get("PYTHONPATH")))
+    ),
+    "PYTHONDONTWRITEBYTECODE": "1",
+}
+
+
+def build_firefox_style_db(path):
     """
     Creates a SQLite database with a schema similar to Firefox's places.sqlite.
     This includes tables with foreign keys, indexes, and triggers, and WAL mode.
     """
     conn = sqlite3.connect(path)
     conn.execute("PRAGMA journal_mode=WAL")
+    # WAL stays consistent at NORMAL; FULL only adds an fsync per commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # Read pages through a mapping while building the indexes (this connection only)
+    conn.execute("PRAGMA mmap_size=268435456")
 
     # Enable foreign keys
     conn.execute("PRAGMA foreign_keys=ON")
 
     # simplified schema based on places.sqlite
+    # One transaction for schema and data, so it is committed with one WAL flush
     conn.executescript("""
+        BEGIN IMMEDIATE;
+
         CREATE TABLE moz_places (
             id INTEGER PRIMARY KEY,
             url LONGVARCHAR,
@@ -51,23 +78,97 @@ def create_firefox_style_db(path):
         CREATE INDEX moz_historyvisits_placedateindex ON moz_historyvisits (place_id, visit_date);
         CREATE INDEX moz_historyvisits_fromindex ON moz_historyvisits (from_visit);
         CREATE INDEX moz_historyvisits_dateindex ON moz_historyvisits (visit_date);
+        CREATE INDEX moz_places_faviconindex ON moz_places (favicon_id);
+        CREATE INDEX moz_places_originidindex ON moz_places (origin_id);
         
         -- Insert some dummy data
-        INSERT INTO moz_places (url, title, rev_host) VALUES ('https://www.google.com/', 'Google', 'moc.elgoog.www.');
-        INSERT INTO moz_places (url, title, rev_host) VALUES ('https://github.com/', 'GitHub', 'moc.buhtig.');
-        
-        INSERT INTO moz_historyvisits (place_id, visit_date, visit_type) VALUES (1, 1630000000000000, 1);
-        INSERT INTO moz_historyvisits (place_id, visit_date, visit_type) VALUES (2, 1630000010000000, 1);
+        INSERT INTO moz_places (url, title, rev_host) VALUES
+            ('https://www.google.com/', 'Google', 'moc.elgoog.www.'),
+            ('https://github.com/', 'GitHub', 'moc.buhtig.');
+
+        INSERT INTO moz_historyvisits (place_id, visit_date, visit_type) VALUES
+            (1, 1630000000000000, 1),
+            (2, 1630000010000000, 1);
+
+        COMMIT;
     """)
 
-    conn.commit()
+    # Populate sqlite_stat1 like a real (Firefox-optimized) profile. The script
+    # committed itself, and ANALYZE opens no implicit transaction: no commit().
+    conn.execute("ANALYZE")
+    # Merge the WAL into the main file so clean reads a single file. The last
+    # close() would checkpoint too, but not if anything else still has it open.
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
     conn.close()
 
 
+@lru_cache(maxsize=None)
+def fixture_cache_path():
+    """
+    Where a built fixture is kept between runs. Keyed on the builder's source
+    (schema, data and pragmas) and the SQLite version, so any change rebuilds.
+    """
+    recipe = inspect.getsource(build_firefox_style_db) + sqlite3.sqlite_version
+    key = hashlib.blake2b(recipe.encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"git_sqlite_filter_ffprof_{key}.sqlite")
+
+
+def create_firefox_style_db(path):
+    """
+    Copies the cached Firefox-style fixture to path, building it on a miss.
+    The fixture is fully checkpointed, so the main file alone is complete.
+    """
+    cache_path = fixture_cache_path()
+    with contextlib.suppress(FileNotFoundError):
+        shutil.copyfile(cache_path, path)
+        return
+
+    build_firefox_style_db(path)
+    # Publish atomically; concurrent runs may race to fill the cache
+    fd, tmp_cache_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+    os.close(fd)
+    try:
+        shutil.copyfile(path, tmp_cache_path)
+        os.replace(tmp_cache_path, cache_path)
+    except OSError:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_cache_path)
+
+
+CleanScan = namedtuple(
+    "CleanScan", "returncode head seen_insert seen_wal_pragma stderr"
+)
+
+
+def scan_clean_output(cmd, env=None, head_size=200):
+    """
+    Run clean and scan its dump line by line, keeping only the first
+    head_size bytes, so memory stays flat however large the database is.
+    """
+    head = b""
+    seen_insert = seen_wal_pragma = False
+    # stderr goes to a file so a chatty child can't block on a full pipe
+    with tempfile.TemporaryFile() as err, subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=err, bufsize=1 << 20, env=env
+    ) as proc:
+        for line in proc.stdout:
+            if len(head) < head_size:
+                head += line[: head_size - len(head)]
+            # Statements start a line; anchoring skips text inside string values
+            seen_insert = seen_insert or line.startswith(b"INSERT INTO")
+            seen_wal_pragma = seen_wal_pragma or line.startswith(
+                b"PRAGMA journal_mode=WAL"
+            )
+        proc.wait()
+        err.seek(0)
+        stderr = err.read().decode("utf-8", errors="replace")
+    return CleanScan(proc.returncode, head, seen_insert, seen_wal_pragma, stderr)
+
+
 def main():
     """Main verification procedure."""
-    with tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False) as tmp:
-        db_path = tmp.name
+    fd, db_path = tempfile.mkstemp(suffix=".sqlite")
+    os.close(fd)  # SQLite opens it by path; an empty file is a valid new database
 
     try:
         print(f"Creating Firefox-style DB at {db_path}...")
@@ -75,49 +176,40 @@ def main():
 
         print("Running git-sqlite-clean...")
         # Assume git-sqlite-clean is installed or in path, or use local src
-        cmd = ["git-sqlite-clean", db_path]
-
-        # If not in path, try to run from source
-        if (
-            subprocess.run(
-                ["which", "git-sqlite-clean"], capture_output=True, check=False
-            ).returncode
-            != 0
-        ):
+        clean_exe = shutil.which("git-sqlite-clean")
+        env = None
+        if clean_exe:
+            cmd = [clean_exe, db_path]
+        else:
             print(
-                "git-sqlite-clean not found in PATH, using src/git_sqlite_filter/clean.py"
-            )
-            src_path = os.path.join(
-                os.path.dirname(__file__), "..", "src", "git_sqlite_filter", "clean.py"
+                "git-sqlite-clean not found in PATH, running git_sqlite_filter.clean from src/"
             )
-            cmd = [sys.executable, src_path, db_path]
+            cmd = [*CLEAN_FALLBACK_CMD, db_path]
+            env = CLEAN_FALLBACK_ENV
 
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        scan = scan_clean_output(cmd, env)
 
-        if result.returncode != 0:
+        if scan.returncode != 0:
             print("ERROR: git-sqlite-clean failed!")
-            print("Stderr:", result.stderr)
+            print("Stderr:", scan.stderr)
             sys.exit(1)
 
         print("Success! Output snippet:")
-        print(result.stdout[:200] + "...")
+        print(scan.head.decode("utf-8", errors="replace") + "...")
 
         # Basic validation of output
-        if "INSERT INTO" not in result.stdout:
+        if not scan.seen_insert:
             print("ERROR: Output doesn't look like SQL dump")
             sys.exit(1)
 
-        if "PRAGMA journal_mode=WAL" in result.stdout:
+        if scan.seen_wal_pragma:
             print("NOTE: WAL mode pragma found (expected behavior logic check needed)")
 
     finally:
-        if os.path.exists(db_path):
-            os.remove(db_path)
-        # WAL files might be left over if not closed properly, clean them too
-        if os.path.exists(db_path + "-wal"):
-            os.remove(db_path + "-wal")
-        if os.path.exists(db_path + "-shm"):
-            os.remove(db_path + "-shm")
+        # WAL/journal files might be left over if not closed properly, clean them too
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(db_path + suffix)
 
 
 if __name__ == "__main__":